@@ -9,18 +9,28 @@ from __future__ import annotations
 
 import logging
 
-from flask import Flask
+from flask import Flask, Response, g, request, stream_with_context
 from flask_cors import CORS
-from flask_restful import Api, Resource, abort, marshal_with, fields
-from tasks import scrape
+from flask_restful import Api, Resource, abort, fields
+from tasks import enqueue_scraping, get_scraping_job, scrape
 
-from utility import CoerceWith
-from restaurants import RESTAURANTS, RestaurantsFactory, BaseRestaurant
+from archive import PERIOD_FORMATS, menu_archive
+from cache import menu_cache
+from encoding import IDENTITY, dumps_json, encode_dynamic, negotiate_encoding
+from events import broadcaster
+from utility import CoerceWith, MarshalWith
+from geo import office_location
+from profiling import Profile, collapsed_stacks, list_profiles, load_profile, raw_stats_summary
+from storage import get_redis_client
+from restaurants import (
+    RESTAURANTS, RESTAURANTS_COMPACT_RESPONSE, RESTAURANTS_RESPONSE, RestaurantsFactory, BaseRestaurant, RestaurantMeal
+)
+from restaurants.dishes import DISH_FIELDS, dish_index
 from config import *
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
-    from typing import Optional
+    from typing import Dict, List, Optional, Tuple, Type, Union
 
 
 # FLASK
@@ -29,29 +39,131 @@ api: Api = Api(app)
 cors: CORS = CORS(app)
 
 
+def _encoded_response(body: bytes, encoding: str, status: int = 200, headers: Optional[dict] = None) -> Response:
+    response: Response = Response(body, status=status, mimetype='application/json', headers=headers)
+    response.vary.add('Accept-Encoding')
+    if encoding != IDENTITY:
+        response.headers['Content-Encoding'] = encoding
+
+    return response
+
+
+@api.representation('application/json')
+def output_json(data: object, code: int, headers: Optional[dict] = None) -> Response:
+    """Compact JSON representation of dynamic responses (compressed when accepted by the client)."""
+
+    body, encoding = encode_dynamic(dumps_json(data), request.headers.get('Accept-Encoding'))
+    return _encoded_response(body, encoding, code, headers)
+
+
+def _profiling_allowed() -> bool:
+    """Profiling is available in debug mode or for admins (with the profiling token)."""
+
+    return DEBUG_MODE or bool(PROFILING_TOKEN) and request.headers.get('X-Profiling-Token') == PROFILING_TOKEN
+
+
+@app.before_request
+def start_profiling() -> None:
+    # Opt-in profiling of the single request (by header or query parameter)
+    if (request.headers.get('X-Profile') or request.args.get('profile')) and _profiling_allowed():
+        g.profile = Profile(f'{request.method} {request.full_path}')
+        g.profile.start()
+
+
+@app.after_request
+def stop_profiling(response: Response) -> Response:
+    if 'profile' in g:
+        profile_id: Optional[str] = g.pop('profile').stop()
+        if profile_id is not None:
+            response.headers['X-Profile-Id'] = profile_id
+
+    return response
+
+
+@app.teardown_request
+def end_profiling(exc: Optional[BaseException]) -> None:
+    # Profile of the failed request is stopped as well, otherwise no other request of the process could be profiled
+    if 'profile' in g:
+        g.pop('profile').stop()
+
+
 @api.resource('/')
 class RootResource(Resource):
 
-    @marshal_with({'version': fields.String, 'loaded_scrapers': fields.Integer})
+    @MarshalWith({
+        'version': fields.String,
+        'loaded_scrapers': fields.Integer,
+        'cache': fields.Nested({
+            'hits': fields.Integer, 'misses': fields.Integer, 'hit_ratio': fields.Float, 'size': fields.Integer,
+        }),
+    })
     def get(self):
         return {
             'version': VERSION,
-            'loaded_scrapers': len(RESTAURANTS)
+            'loaded_scrapers': len(RESTAURANTS),
+            'cache': menu_cache.stats(),
         }
 
 
 @api.resource('/restaurants')
 class RestaurantResource(Resource):
 
-    marshal_with(
-        {
-            'loaded_scrapers': fields.Integer,
-            'data': fields.List(fields.Nested(BaseRestaurant.RESTAURANT_FIELDS))
-        }
-    )
-    CoerceWith(CoerceWith.RESTAURANT_FIELDS)
-    def get(self, day: Optional[str] = None, restaurant: Optional[str] = None):
-        data: list = RestaurantsFactory.get_restaurants_data(day, restaurant)
+    @RESTAURANTS_RESPONSE
+    @CoerceWith(CoerceWith.RESTAURANT_FIELDS, location='args')
+    def get(self, day: Optional[str] = None, restaurant: Optional[str] = None, lat: Optional[float] = None,
+            lon: Optional[float] = None, radius: Optional[int] = None, office: Optional[str] = None,
+            compact: bool = False):
+        day = None if day == 'all' else day
+
+        if (lat is None) != (lon is None):
+            abort(400, message='Parameters lat and lon have to be used together.')
+
+        if office:
+            try:
+                office_lat, office_lon, office_radius = office_location(office)
+            except KeyError as exc:
+                abort(400, message=exc.args[0])
+            except ValueError as exc:
+                # Geocoding of offices is done by `geocode.py`, the office is not usable until then
+                abort(503, message=str(exc))
+
+            lat = office_lat if lat is None else lat
+            lon = office_lon if lon is None else lon
+            radius = office_radius if radius is None else radius
+
+        if lat is not None and lon is not None:
+            # Only restaurants near the location are loaded, sorted by the distance
+            nearby: List[Tuple[Type[BaseRestaurant], float]] = RestaurantsFactory.find_nearby(
+                lat, lon, DEFAULT_SEARCH_RADIUS if radius is None else radius
+            )
+            distances: Dict[str, float] = {restaurant_cls._NAME: distance for restaurant_cls, distance in nearby}
+            data: list = [
+                dict(restaurant_data, distance=distances[restaurant_data['name']])
+                for restaurant_data in menu_cache.get_restaurants_data(
+                    day, restaurant, [restaurant_cls for restaurant_cls, _ in nearby]
+                )
+            ]
+        else:
+            if not restaurant and not compact:
+                # The most common query (all restaurants for the day) is served from the precomputed
+                # (and precompressed) view as it is, without marshalling
+                variants: Optional[Dict[str, bytes]] = menu_cache.get_day_view(day)
+                if variants is not None:
+                    encoding: str = negotiate_encoding(request.headers.get('Accept-Encoding'), variants)
+                    return _encoded_response(variants[encoding], encoding)
+
+            data = menu_cache.get_restaurants_data(day, restaurant)
+
+        if compact:
+            # Details of dishes are left out, clients cache them from `/dishes/<dish_id>`
+            return output_json(RESTAURANTS_COMPACT_RESPONSE.marshal({
+                'loaded_scrapers': len(RESTAURANTS),
+                'data_size': len(data),
+                'data': [dict(restaurant_data, meals={
+                    _day: [RestaurantMeal.from_dict(meal).to_reference() for meal in meals]
+                    for _day, meals in restaurant_data['meals'].items()
+                }) for restaurant_data in data],
+            }), 200)
 
         return {
             'loaded_scrapers': len(RESTAURANTS),
@@ -60,26 +172,178 @@ class RestaurantResource(Resource):
         }
 
 
+@api.resource('/dishes/<string:dish_id>')
+class DishResource(Resource):
+
+    @MarshalWith(dict(
+        {'id': fields.String},
+        **{field: value for field, value in RestaurantMeal.MEAL_FIELDS.items() if field in DISH_FIELDS}
+    ))
+    def get(self, dish_id: str):
+        dish: Optional[dict] = dish_index.get_many(get_redis_client(), [dish_id]).get(dish_id)
+        if dish is None:
+            abort(404, message=f'Dish {dish_id} does not exist.')
+
+        # Dishes never change, so clients can cache them forever
+        return dict(dish, id=dish_id), 200, {'Cache-Control': 'public, max-age=31536000, immutable'}
+
+
+def _archive_filters() -> dict:
+    """Common filters of archive queries (restaurant name and date range as ISO dates)."""
+
+    restaurant: Optional[str] = request.args.get('restaurant')
+    return {
+        'restaurant_ids': [restaurant_cls.restaurant_id()
+                           for restaurant_cls in RestaurantsFactory.filter_restaurants(restaurant)]
+                          if restaurant else None,
+        'since': request.args.get('since'),
+        'until': request.args.get('until'),
+    }
+
+
+@api.resource('/archive/prices')
+class ArchivePricesResource(Resource):
+
+    @MarshalWith({'data': fields.List(fields.Nested({
+        'period': fields.String, 'average_price': fields.Float, 'meals': fields.Integer,
+    }))})
+    def get(self):
+        period: str = request.args.get('period', 'week')
+        if period not in PERIOD_FORMATS:
+            abort(400, message=f'Possible periods: {", ".join(PERIOD_FORMATS)}')
+
+        return {'data': menu_archive.price_trend(period=period, **_archive_filters())}
+
+
+@api.resource('/archive/dishes')
+class ArchiveDishesResource(Resource):
+
+    @MarshalWith({'data': fields.List(fields.Nested({
+        'name': fields.String, 'appearances': fields.Integer, 'average_price': fields.Float,
+        'first_seen': fields.String, 'last_seen': fields.String,
+    }))})
+    def get(self):
+        filters: dict = _archive_filters()
+        return {'data': menu_archive.dish_frequency(filters['restaurant_ids'],
+                                                    limit=request.args.get('limit', 20, type=int))}
+
+
+@api.resource('/archive/soups')
+class ArchiveSoupsResource(Resource):
+
+    @MarshalWith({'soups': fields.Integer, 'average_price': fields.Float})
+    def get(self):
+        return menu_archive.soup_price(**_archive_filters())
+
+
+@api.resource('/events')
+class EventsResource(Resource):
+
+    def get(self):
+        # Stream of menu updates, clients do not need to poll `/restaurants`
+        return Response(
+            stream_with_context(broadcaster.stream()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
+
+
 @api.resource('/force-scraping')
 class ScraperResource(Resource):
 
     # NOTE: This only works in debug mode
-    @marshal_with({'failed_scrapers': fields.Integer})
+    @MarshalWith({'job_id': fields.String})
     def get(self):
         if not DEBUG_MODE:
             abort(404)
 
-        failed: int = RestaurantsFactory.execute_scraping(force_scraping=True)
-        logging.warning(f'{failed} scrapers failed during forced scraping.')
+        # Scraping runs in the worker, concurrent requests share the same in-flight job
+        job_id: str = enqueue_scraping(force_scraping=True)
+        logging.warning(f'Forced scraping was requested, job {job_id}.')
 
-        return {
-            'failed_scrapers': failed
-        }
+        return {'job_id': job_id}, 202
+
+
+@api.resource('/force-scraping/<string:job_id>')
+class ScraperJobResource(Resource):
+
+    # NOTE: This only works in debug mode
+    @MarshalWith({
+        'job_id': fields.String, 'status': fields.String, 'failed_scrapers': fields.Integer,
+        'coalesced_with': fields.String,
+    })
+    def get(self, job_id: str):
+        if not DEBUG_MODE:
+            abort(404)
+
+        job: Optional[dict] = get_scraping_job(job_id)
+        if job is None:
+            abort(404, message=f'Scraping job {job_id} does not exist.')
+
+        return job
+
+
+@api.resource('/profiles')
+class ProfilesResource(Resource):
+
+    # NOTE: This only works in debug mode (or with the profiling token)
+    @MarshalWith({'data': fields.List(fields.Nested({
+        'id': fields.String, 'name': fields.String, 'created_at': fields.Float, 'duration': fields.Float,
+    }))})
+    def get(self):
+        if not _profiling_allowed():
+            abort(404)
+
+        return {'data': list_profiles(get_redis_client())}
+
+
+@api.resource('/profiles/<string:profile_id>')
+class ProfileResource(Resource):
+
+    # Download formats: collapsed stacks (flamegraph), raw `pstats` data and text summary
+    FORMATS: Dict[str, Tuple[str, str]] = {
+        'collapsed': ('text/plain', 'folded'),
+        'pstats': ('application/octet-stream', 'pstats'),
+        'text': ('text/plain', 'txt'),
+    }
+
+    # NOTE: This only works in debug mode (or with the profiling token)
+    def get(self, profile_id: str):
+        if not _profiling_allowed():
+            abort(404)
+
+        output_format: str = request.args.get('format', 'collapsed')
+        if output_format not in self.FORMATS:
+            abort(400, message=f'Possible formats: {", ".join(self.FORMATS)}')
+
+        raw_stats: Optional[bytes] = load_profile(get_redis_client(), profile_id)
+        if raw_stats is None:
+            abort(404, message=f'Profile {profile_id} does not exist.')
+
+        if output_format == 'collapsed':
+            body: Union[bytes, str] = collapsed_stacks(raw_stats)
+        elif output_format == 'text':
+            body = raw_stats_summary(raw_stats)
+        else:
+            body = raw_stats
+
+        mimetype, extension = self.FORMATS[output_format]
+        return Response(body, mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename={profile_id}.{extension}'})
 
 
 if DEBUG_MODE:
     logging.basicConfig(level=logging.DEBUG)
 
+# Every worker starts with warm cache which is kept fresh by menu update events
+broadcaster.add_callback(menu_cache.on_menu_update)
+menu_cache.warm_up()
+
+try:
+    RestaurantsFactory.index_locations()
+except Exception as exc:
+    logging.error(f'Indexing of restaurant locations failed with exception: {str(exc)}.')
+
 if __name__ == '__main__':
     app.run(debug=DEBUG_MODE, host=IP, port=PORT)
 
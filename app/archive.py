@@ -0,0 +1,251 @@
+"""
+Archive
+=======
+
+Module containing append-only archive of menu snapshots (SQLite) with precomputed aggregates.
+
+Every change of a restaurant day is stored as a new snapshot of the date. Meals are stored only once in
+the dish dictionary and snapshots just reference them (with price). Aggregates (daily prices, dish
+statistics) are maintained incrementally for the latest snapshot of every date, so analytics queries
+never scan the raw snapshots.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from utility import week_date
+from config import ARCHIVE_PATH
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from datetime import date
+    from typing import Dict, List, Optional
+
+
+_SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS dishes (
+    id INTEGER PRIMARY KEY,
+    fingerprint TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    description TEXT,
+    alergens TEXT,
+    is_vegan INTEGER NOT NULL,
+    is_gluten_free INTEGER NOT NULL,
+    is_soup INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    restaurant_id INTEGER NOT NULL,
+    menu_date TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    UNIQUE (restaurant_id, menu_date, version)
+);
+CREATE TABLE IF NOT EXISTS snapshot_items (
+    snapshot_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    dish_id INTEGER NOT NULL,
+    price REAL NOT NULL,
+    PRIMARY KEY (snapshot_id, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS latest_snapshots (
+    restaurant_id INTEGER NOT NULL,
+    menu_date TEXT NOT NULL,
+    snapshot_id INTEGER NOT NULL,
+    PRIMARY KEY (restaurant_id, menu_date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS daily_stats (
+    restaurant_id INTEGER NOT NULL,
+    menu_date TEXT NOT NULL,
+    meals INTEGER NOT NULL,
+    price_sum REAL NOT NULL,
+    soups INTEGER NOT NULL,
+    soup_price_sum REAL NOT NULL,
+    PRIMARY KEY (restaurant_id, menu_date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS dish_stats (
+    dish_id INTEGER NOT NULL,
+    restaurant_id INTEGER NOT NULL,
+    appearances INTEGER NOT NULL,
+    price_sum REAL NOT NULL,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    PRIMARY KEY (dish_id, restaurant_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS daily_stats_date ON daily_stats (menu_date);
+"""
+
+# Grouping of dates for price trends
+PERIOD_FORMATS: Dict[str, str] = {'day': '%Y-%m-%d', 'week': '%Y-%W', 'month': '%Y-%m', 'year': '%Y'}
+
+
+def _dish_fingerprint(meal: dict) -> str:
+    """Identity of the dish, its normalized ID (see `restaurants.dishes`) or everything except the price."""
+
+    if meal.get('dish_id'):
+        return f'dish-{meal["dish_id"]}'  # Variants of the same dish are counted together
+
+    identity: list = [meal.get('name'), meal.get('description'), sorted(meal.get('alergens') or []),
+                      bool(meal.get('is_vegan')), bool(meal.get('is_gluten_free')), bool(meal.get('is_soup'))]
+    return hashlib.sha1(json.dumps(identity, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _restaurant_filter(restaurant_ids: Optional[List[int]], column: str = 'restaurant_id') -> tuple:
+    """SQL condition (and its parameters) limiting results to selected restaurants."""
+
+    if restaurant_ids is None:
+        return '1', []
+
+    return f'{column} IN ({", ".join("?" * len(restaurant_ids))})', list(restaurant_ids)
+
+
+class MenuArchive:
+    """Archive of menu snapshots stored in a single SQLite file."""
+
+    def __init__(self, path: str = ARCHIVE_PATH) -> None:
+        self.path: str = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Lazily opened connection (so it is never shared by forked worker processes)."""
+
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._connection.execute('PRAGMA journal_mode=WAL')  # Readers are not blocked by the writer
+            self._connection.execute('PRAGMA busy_timeout=5000')
+            self._connection.executescript(_SCHEMA)
+
+        return self._connection
+
+    def _dish_id(self, meal: dict) -> int:
+        fingerprint: str = _dish_fingerprint(meal)
+        self.connection.execute(
+            'INSERT OR IGNORE INTO dishes (fingerprint, name, description, alergens, is_vegan, is_gluten_free, '
+            'is_soup) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (fingerprint, meal.get('name'), meal.get('description'), json.dumps(meal.get('alergens') or []),
+             int(bool(meal.get('is_vegan'))), int(bool(meal.get('is_gluten_free'))), int(bool(meal.get('is_soup')))),
+        )
+        return self.connection.execute('SELECT id FROM dishes WHERE fingerprint = ?', (fingerprint,)).fetchone()[0]
+
+    def _update_dish_stats(self, restaurant_id: int, menu_date: str, items: list, sign: int) -> None:
+        """Add (`sign` 1) or remove (`sign` -1) items of the snapshot to/from dish statistics."""
+
+        for dish_id, price in items:
+            self.connection.execute(
+                'INSERT INTO dish_stats (dish_id, restaurant_id, appearances, price_sum, first_seen, last_seen) '
+                'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (dish_id, restaurant_id) DO UPDATE SET '
+                'appearances = appearances + excluded.appearances, price_sum = price_sum + excluded.price_sum, '
+                'first_seen = MIN(first_seen, excluded.first_seen), last_seen = MAX(last_seen, excluded.last_seen)',
+                (dish_id, restaurant_id, sign, sign * price, menu_date, menu_date),
+            )
+
+    def archive_day(self, restaurant_id: int, menu_date: date, version: int, meals: List[dict]) -> None:
+        """Append snapshot of the restaurant day and update aggregates of the date."""
+
+        _date: str = menu_date.isoformat()
+
+        with self._lock:
+            connection: sqlite3.Connection = self.connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                cursor: sqlite3.Cursor = connection.execute(
+                    'INSERT OR IGNORE INTO snapshots (restaurant_id, menu_date, version, created_at) VALUES (?, ?, ?, ?)',
+                    (restaurant_id, _date, version, time.time()),
+                )
+                if cursor.rowcount == 0:
+                    connection.execute('ROLLBACK')
+                    return  # Snapshot was already archived
+
+                snapshot_id: int = cursor.lastrowid
+
+                items: list = [(self._dish_id(meal), float(meal.get('price') or 0.0)) for meal in meals]
+                connection.executemany(
+                    'INSERT INTO snapshot_items (snapshot_id, position, dish_id, price) VALUES (?, ?, ?, ?)',
+                    [(snapshot_id, position, dish_id, price) for position, (dish_id, price) in enumerate(items)],
+                )
+
+                # Aggregates reflect only the latest snapshot, so the previous one is subtracted
+                previous: Optional[tuple] = connection.execute(
+                    'SELECT snapshot_id FROM latest_snapshots WHERE restaurant_id = ? AND menu_date = ?',
+                    (restaurant_id, _date),
+                ).fetchone()
+                if previous:
+                    previous_items: list = connection.execute(
+                        'SELECT dish_id, price FROM snapshot_items WHERE snapshot_id = ?', (previous[0],)
+                    ).fetchall()
+                    self._update_dish_stats(restaurant_id, _date, previous_items, -1)
+
+                self._update_dish_stats(restaurant_id, _date, items, 1)
+
+                soups: list = [price for meal, (_, price) in zip(meals, items) if meal.get('is_soup')]
+                connection.execute(
+                    'INSERT OR REPLACE INTO daily_stats (restaurant_id, menu_date, meals, price_sum, soups, '
+                    'soup_price_sum) VALUES (?, ?, ?, ?, ?, ?)',
+                    (restaurant_id, _date, len(items), sum(price for _, price in items), len(soups), sum(soups)),
+                )
+                connection.execute(
+                    'INSERT OR REPLACE INTO latest_snapshots (restaurant_id, menu_date, snapshot_id) VALUES (?, ?, ?)',
+                    (restaurant_id, _date, snapshot_id),
+                )
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+
+    def archive_days(self, restaurant_id: int, days: Dict[str, List[dict]], versions: Dict[str, int],
+                     today: Optional[date] = None) -> None:
+        """Archive changed days (meals as dicts) of the current menu week (see `week_date`)."""
+
+        for day, version in versions.items():
+            self.archive_day(restaurant_id, week_date(day, today), version, days[day])
+
+    def price_trend(self, restaurant_ids: Optional[List[int]] = None, since: Optional[str] = None,
+                    until: Optional[str] = None, period: str = 'week') -> List[dict]:
+        """Average meal price grouped by the period (day, week, month or year)."""
+
+        condition, parameters = _restaurant_filter(restaurant_ids)
+        rows: list = self.connection.execute(
+            f'SELECT strftime(?, menu_date) AS period, SUM(price_sum) / SUM(meals), SUM(meals) FROM daily_stats '
+            f'WHERE {condition} AND menu_date >= ? AND menu_date <= ? AND meals > 0 GROUP BY period ORDER BY period',
+            [PERIOD_FORMATS[period]] + parameters + [since or '0000-00-00', until or '9999-99-99'],
+        ).fetchall()
+
+        return [{'period': row[0], 'average_price': row[1], 'meals': row[2]} for row in rows]
+
+    def dish_frequency(self, restaurant_ids: Optional[List[int]] = None, limit: int = 20) -> List[dict]:
+        """Most frequent dishes with amount of days they appeared in menus."""
+
+        condition, parameters = _restaurant_filter(restaurant_ids, 'dish_stats.restaurant_id')
+        rows: list = self.connection.execute(
+            f'SELECT dishes.name, SUM(appearances) AS total, SUM(price_sum) / SUM(appearances), MIN(first_seen), '
+            f'MAX(last_seen) FROM dish_stats JOIN dishes ON dishes.id = dish_stats.dish_id WHERE {condition} '
+            f'GROUP BY dishes.id HAVING total > 0 ORDER BY total DESC LIMIT ?',
+            parameters + [limit],
+        ).fetchall()
+
+        return [{'name': row[0], 'appearances': row[1], 'average_price': row[2], 'first_seen': row[3],
+                 'last_seen': row[4]} for row in rows]
+
+    def soup_price(self, restaurant_ids: Optional[List[int]] = None, since: Optional[str] = None,
+                   until: Optional[str] = None) -> dict:
+        """Average soup price in the date range."""
+
+        condition, parameters = _restaurant_filter(restaurant_ids)
+        soups, soup_price_sum = self.connection.execute(
+            f'SELECT SUM(soups), SUM(soup_price_sum) FROM daily_stats WHERE {condition} '
+            f'AND menu_date >= ? AND menu_date <= ?',
+            parameters + [since or '0000-00-00', until or '9999-99-99'],
+        ).fetchone()
+
+        return {'soups': soups or 0, 'average_price': soup_price_sum / soups if soups else None}
+
+
+# Global archive instance (one connection per process)
+menu_archive: MenuArchive = MenuArchive()
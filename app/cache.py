@@ -0,0 +1,236 @@
+"""
+Cache
+=====
+
+Module containing in-process (read-through) cache of restaurant menus used by the web tier.
+
+Cache is filled on startup by one bulk fetch from Redis, entries are bounded by LRU with TTL and are
+invalidated by version stamps of days which are published by the scraping pipeline.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+import traceback
+
+from collections import OrderedDict
+from encoding import ENCODINGS
+from restaurants import RestaurantsFactory
+from storage import get_redis_client, load_day_view
+from utility import WeekDays
+from config import MENU_CACHE_SIZE, MENU_CACHE_TTL
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Dict, List, Optional, Tuple, Type
+    from restaurants import BaseRestaurant
+
+
+# Cache key representing the whole week
+_ALL_DAYS: str = 'all'
+# Key of the last scraping timestamp in versions of entries (it is versioned as a day, data contain it)
+_LAST_SCRAPING: str = 'last_scraping'
+
+
+class MenuCache:
+    """LRU cache with TTL of restaurant data, keyed by restaurant ID and day."""
+
+    def __init__(self, max_size: int = MENU_CACHE_SIZE, ttl: int = MENU_CACHE_TTL) -> None:
+        self.max_size: int = max_size
+        self.ttl: int = ttl
+        self.hits: int = 0
+        self.misses: int = 0
+
+        # (restaurant ID, day) -> (data, versions of days in data, expiration time)
+        self._entries: OrderedDict = OrderedDict()
+        # Newest versions of days announced by scraping, older data are never cached
+        self._latest_versions: Dict[int, Dict[str, int]] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def _key(restaurant_id: int, day: Optional[str]) -> Tuple[int, str]:
+        return restaurant_id, str(day) if day else _ALL_DAYS
+
+    @staticmethod
+    def _view_key(day: Optional[str]) -> Tuple[str, str]:
+        return 'view', str(day) if day else _ALL_DAYS
+
+    def _is_outdated(self, restaurant_id: int, versions: Dict[str, int]) -> bool:
+        latest: Dict[str, int] = self._latest_versions.get(restaurant_id, {})
+        return any(versions.get(day, 0) < version for day, version in latest.items() if day in versions)
+
+    def get(self, restaurant_id: int, day: Optional[str]) -> Optional[dict]:
+        """Retrieve cached restaurant data (`None` on miss)."""
+
+        return self._get(self._key(restaurant_id, day))
+
+    def _get(self, key: tuple) -> Optional[object]:
+        with self._lock:
+            entry: Optional[tuple] = self._entries.get(key)
+            if entry is None or entry[2] < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, restaurant_id: int, day: Optional[str], data: dict, versions: Dict[str, int]) -> None:
+        """Store restaurant data with versions of days it was built from."""
+
+        days: List[str] = ([str(day)] if day else list(data['meals'].keys())) + [_LAST_SCRAPING]
+        entry_versions: Dict[str, int] = {_day: versions.get(_day, 0) for _day in days}
+
+        with self._lock:
+            if self._is_outdated(restaurant_id, entry_versions):
+                return  # Newer data were already announced, do not cache stale ones
+
+            self._store(self._key(restaurant_id, day), data, entry_versions)
+
+    def _store(self, key: tuple, data: object, versions: Dict[str, int]) -> None:
+        """Store entry and evict the least recently used ones (lock has to be held)."""
+
+        self._entries[key] = (data, versions, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, restaurant_id: int, versions: Dict[str, int]) -> None:
+        """Drop entries of the restaurant which contain days older than announced versions."""
+
+        with self._lock:
+            latest: Dict[str, int] = self._latest_versions.setdefault(restaurant_id, {})
+            for day, version in versions.items():
+                latest[day] = max(latest.get(day, 0), version)
+
+            for key in [key for key in self._entries if key[0] == restaurant_id]:
+                if self._is_outdated(restaurant_id, self._entries[key][1]):
+                    del self._entries[key]
+
+    def on_menu_update(self, raw_event: str) -> None:
+        """Callback for menu update events (see `storage.publish_menu_update`)."""
+
+        event: dict = json.loads(raw_event)
+
+        if 'views' in event:
+            with self._lock:
+                for day in event['views']:
+                    self._entries.pop(self._view_key(day if day != _ALL_DAYS else None), None)
+            return
+
+        versions: Dict[str, float] = dict(event['days'])
+        if event.get('last_scraping'):
+            versions[_LAST_SCRAPING] = event['last_scraping']
+
+        self.invalidate(int(event['restaurant_id']), versions)
+
+    def get_day_view(self, day: Optional[str]) -> Optional[Dict[str, bytes]]:
+        """Retrieve serialized response with all restaurants for the day by its encoding (precomputed view),
+        `None` if the view was not built yet.
+        """
+
+        key: Tuple[str, str] = self._view_key(day)
+        variants: Optional[Dict[str, bytes]] = self._get(key)
+        if variants is not None:
+            return variants
+
+        variants = load_day_view(get_redis_client(), day, ENCODINGS)
+        if variants is None:
+            return None
+
+        with self._lock:
+            self._store(key, variants, {})
+
+        return variants
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def _snapshot_versions(restaurant_instance: BaseRestaurant, versions: Dict[str, int]) -> Dict[str, float]:
+        """Versions of days of the snapshot including the time of the last scraping."""
+
+        return dict(versions, **{_LAST_SCRAPING: restaurant_instance.last_scraping.timestamp()})
+
+    def warm_up(self) -> int:
+        """Fill cache with data of all restaurants (for every day and the whole week) in one bulk fetch.
+
+        Returns amount of cached entries.
+        """
+
+        try:
+            snapshots: dict = RestaurantsFactory.get_restaurants_snapshots()
+        except Exception as exc:
+            logging.error(f'Warm up of menu cache failed with exception: {str(exc)}.')
+            logging.debug(f'Exception trace for menu cache warm up: {traceback.format_exc()}.')
+            return 0
+
+        for restaurant, (restaurant_instance, versions) in snapshots.items():
+            if not versions:
+                continue  # Restaurant was never scraped, nothing to cache
+
+            versions = self._snapshot_versions(restaurant_instance, versions)
+            for day in [None] + WeekDays.all_days():
+                self.set(restaurant.restaurant_id(), day, restaurant_instance.to_dict(day), versions)
+
+        logging.info(f'Menu cache was warmed up with {len(self._entries)} entries.')
+        return len(self._entries)
+
+    def get_restaurants_data(self, day: Optional[str], restaurant_name: Optional[str],
+                             restaurants: Optional[List[Type[BaseRestaurant]]] = None) -> list:
+        """Read-through variant of `RestaurantsFactory.get_restaurants_data`.
+
+        If `restaurants` are set, only those (in the same order) are used instead of the whole registry.
+        """
+
+        resulting_restaurants: list = []
+
+        if restaurants is None:
+            restaurants = RestaurantsFactory.filter_restaurants(restaurant_name)
+        elif restaurant_name:
+            allowed: List[Type[BaseRestaurant]] = RestaurantsFactory.filter_restaurants(restaurant_name)
+            restaurants = [restaurant for restaurant in restaurants if restaurant in allowed]
+
+        for restaurant in restaurants:
+            resulting_restaurants.append((restaurant, self.get(restaurant.restaurant_id(), day)))
+
+        # All missed restaurants are loaded in one bulk fetch
+        missing: List[Type[BaseRestaurant]] = [restaurant for restaurant, data in resulting_restaurants if data is None]
+        loaded: Dict[Type[BaseRestaurant], dict] = {}
+        if missing:
+            try:
+                snapshots: dict = RestaurantsFactory.get_restaurants_snapshots(missing)
+            except Exception as exc:
+                logging.error(f'Loading restaurants {[restaurant._NAME for restaurant in missing]} failed with '
+                              f'exception: {str(exc)}.')
+                logging.debug(f'Exception trace for loading restaurants: {traceback.format_exc()}.')
+                snapshots = {}
+
+            for restaurant, (restaurant_instance, versions) in snapshots.items():
+                loaded[restaurant] = restaurant_instance.to_dict(day)
+                self.set(restaurant.restaurant_id(), day, loaded[restaurant],
+                         self._snapshot_versions(restaurant_instance, versions))
+
+        return [loaded.get(restaurant) if data is None else data for restaurant, data in resulting_restaurants
+                if data is not None or restaurant in loaded]
+
+    def stats(self) -> dict:
+        """Hit/miss counters for tuning of the cache."""
+
+        requests: int = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / requests if requests else 0.0,
+            'size': len(self._entries),
+        }
+
+
+# Global menu cache instance (one per process)
+menu_cache: MenuCache = MenuCache()
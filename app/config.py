@@ -5,6 +5,8 @@ Config
 Module containing all neccessary configs.
 """
 
+import os
+
 
 # API config
 DEBUG_MODE: bool = True  # Change this to `False` in production
@@ -18,3 +20,72 @@ IP: str = '0.0.0.0'
 REDID_IP: str = 'localhost'
 REDIS_PORT: int = 6379
 REDIS_SERVICE: str = 'redis'
+
+# Menu update events config
+MENU_UPDATES_CHANNEL: str = 'menu-updates'
+VIEW_UPDATES_CHANNEL: str = 'view-updates'  # Rebuilt day views, only for web workers (not streamed to clients)
+EVENTS_HEARTBEAT: int = 15  # Seconds between keep-alive comments in the event stream
+EVENTS_QUEUE_SIZE: int = 100  # Max pending events per client, slow clients drop events over this limit
+
+# Scraping locks config
+SCRAPING_LOCK_TTL: int = 900  # Lease of the single restaurant scraping including retries (15 minutes)
+SCRAPING_RUN_LOCK_TTL: int = 1800  # Lease of the whole scraping run (from dispatching until aggregation)
+DAY_VIEWS_LOCK_TTL: int = 60  # Lease of building day views (snapshot is read and views are written under it)
+
+# Scrape supervision config
+SCRAPE_TIMEOUT: int = 180  # Wall-clock limit of the single restaurant scraping (seconds)
+SCRAPE_MAX_RSS: int = 768 * 1024 * 1024  # Memory limit of browser processes of the single scraping (bytes)
+SCRAPE_WATCHDOG_INTERVAL: float = 1.0  # How often are limits checked (seconds)
+SCRAPE_REPORTS_LIMIT: int = 500  # Amount of kept resource usage reports
+SCRAPE_WORKER_MAX_TASKS: int = 20  # Worker process is replaced after this amount of tasks
+SCRAPE_WORKER_MAX_MEMORY: int = 512 * 1024  # Worker process is replaced when exceeding this RSS (KiB)
+
+# In-process menu cache config (web tier)
+MENU_CACHE_SIZE: int = 1024  # Max amount of cached restaurant days
+MENU_CACHE_TTL: int = 300  # Seconds, guards against missed invalidation events
+
+# Geo config
+# Offices for which we are searching restaurants, location is geocoded from the address (see `geocode.py`)
+OFFICES: dict = {
+    'brno': {'address': 'Brno (602 00)', 'radius': 1500},
+}
+DEFAULT_SEARCH_RADIUS: int = 1500  # Meters
+COORDINATES_FILE: str = 'coordinates.json'  # Cache of geocoded addresses (relative to the app directory)
+
+# Time config
+TIMEZONE: str = 'Europe/Prague'
+
+# Menu archive config
+ARCHIVE_PATH: str = os.environ.get('ARCHIVE_PATH', 'archive.sqlite3')  # SQLite file shared by worker and web
+
+# Scraping resilience config
+SCRAPE_RETRIES: int = 3  # Attempts of the single restaurant scraping
+SCRAPE_RETRY_BASE_DELAY: float = 2.0  # Seconds, doubled with every attempt (with full jitter)
+SCRAPE_RETRY_MAX_DELAY: float = 30.0
+CIRCUIT_FAILURE_THRESHOLD: int = 3  # Failed scrapings in a row before the restaurant is skipped
+CIRCUIT_COOLDOWN: int = 3 * 3600  # Seconds for which the broken restaurant is skipped
+RATE_LIMIT_PER_MINUTE: float = 6.0  # Page loads per domain
+RATE_LIMIT_BURST: int = 2
+RATE_LIMIT_MAX_WAIT: float = 60.0  # Seconds, scraping fails when the domain is busy for longer
+
+# Scraping task graph config
+SCRAPING_QUEUE: str = 'scraping'  # Queue of the per-restaurant scraping tasks
+SCRAPING_RUNS_LIMIT: int = 100  # Amount of kept statistics of scraping runs
+SCRAPING_RUN_STATS_TTL: int = 7 * 24 * 3600  # Seconds for which statistics of the run are available by its ID
+
+# Response encoding config
+COMPRESSION_MIN_SIZE: int = 1024  # Smaller dynamic responses are not compressed (bytes)
+DYNAMIC_COMPRESSION_LEVEL: int = 6  # Gzip level of dynamic responses, precomputed views use the maximal one
+
+# Profiling config
+PROFILE_SCRAPES: bool = os.environ.get('PROFILE_SCRAPES', '') == '1'  # Profile every scraping in the worker
+PROFILING_TOKEN: str = os.environ.get('PROFILING_TOKEN', '')  # Allows profiling outside of debug mode (admin)
+PROFILES_LIMIT: int = 50  # Amount of kept profiles
+PROFILES_TTL: int = 24 * 3600  # Seconds for which the profile is kept
+
+# Dish normalization config
+DISH_SIMILARITY_THRESHOLD: float = 0.8  # Jaccard similarity of n-grams for variants of the same dish
+DISH_NGRAM_SIZE: int = 3  # Characters
+DISH_MINHASH_PERMUTATIONS: int = 64
+DISH_MINHASH_BANDS: int = 16  # LSH bands (permutations are split to them evenly)
+DISH_WORD_ENDING: int = 2  # Characters at the end of words which can differ in variants (inflection, typos)
@@ -0,0 +1,99 @@
+"""
+Encoding
+========
+
+Module containing fast (compact) JSON encoding and negotiated compression of HTTP responses.
+
+Optional dependencies are used when installed: `orjson` for JSON encoding and `brotli` for compression.
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+
+from config import COMPRESSION_MIN_SIZE, DYNAMIC_COMPRESSION_LEVEL
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+IDENTITY: str = 'identity'
+
+# Supported encodings ordered by preference (the best compression first)
+ENCODINGS: List[str] = (['br'] if brotli is not None else []) + ['gzip', IDENTITY]
+
+
+def dumps_json(data: object) -> bytes:
+    """Serialize data to compact JSON (UTF-8 without escaping of non-ASCII characters)."""
+
+    if orjson is not None:
+        return orjson.dumps(data)
+
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """Compress data by the encoding, maximal compression is used by default (for precomputed payloads)."""
+
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if level is None else level)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=9 if level is None else level)
+
+    return data
+
+
+def compress_variants(data: bytes) -> Dict[str, bytes]:
+    """Precompute payload in all supported encodings."""
+
+    return {encoding: compress(data, encoding) for encoding in ENCODINGS}
+
+
+def negotiate_encoding(accept_encoding: Optional[str], available: Iterable[str] = ENCODINGS) -> str:
+    """Choose the preferred available encoding accepted by the client (by `Accept-Encoding` header)."""
+
+    accepted: Dict[str, float] = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, parameters = part.strip().partition(';')
+        quality: float = 1.0
+        if parameters.strip().startswith('q='):
+            try:
+                quality = float(parameters.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+
+    available = list(available)
+    for encoding in ENCODINGS:
+        if encoding == IDENTITY or encoding not in available:
+            continue
+
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+
+    return IDENTITY
+
+
+def encode_dynamic(data: bytes, accept_encoding: Optional[str]) -> Tuple[bytes, str]:
+    """Compress dynamic (not precomputed) response body if it is worth it, returns body and used encoding."""
+
+    if len(data) < COMPRESSION_MIN_SIZE:
+        return data, IDENTITY
+
+    encoding: str = negotiate_encoding(accept_encoding)
+    # Brotli levels are not comparable to gzip ones, its fast levels are used for dynamic responses
+    level: int = 4 if encoding == 'br' else DYNAMIC_COMPRESSION_LEVEL
+    return compress(data, encoding, level), encoding
@@ -0,0 +1,142 @@
+"""
+Events
+======
+
+Module fanning out menu update events from Redis pub/sub to connected clients.
+
+Every web process holds a single Redis subscription (consumed by a background thread) and copies
+received events into queues of connected clients, which are then streamed as Server-Sent Events.
+Events of internal channels (e.g. rebuilt day views) are passed only to in-process callbacks.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+
+from queue import Empty, Full, Queue
+from storage import _decode, get_redis_client
+from config import EVENTS_HEARTBEAT, EVENTS_QUEUE_SIZE, MENU_UPDATES_CHANNEL, VIEW_UPDATES_CHANNEL
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Callable, Iterator, List, Optional, Set
+
+
+# Delay before subscription is renewed after the connection to Redis was lost
+_RECONNECT_DELAY: int = 5
+
+
+class MenuEventsBroadcaster:
+    """Process wide fan-out of menu update events."""
+
+    def __init__(self, channel: str = MENU_UPDATES_CHANNEL,
+                 internal_channels: Optional[List[str]] = None) -> None:
+        self._channel: str = channel
+        self._internal_channels: List[str] = [VIEW_UPDATES_CHANNEL] if internal_channels is None else internal_channels
+        self._listeners: Set[Queue] = set()
+        self._callbacks: List[Callable[[str], None]] = []
+        self._lock: threading.Lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def listeners_count(self) -> int:
+        """Amount of currently connected clients."""
+
+        return len(self._listeners)
+
+    def start(self) -> None:
+        """Start consuming Redis subscription (only once per process)."""
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, name='menu-events', daemon=True)
+                self._thread.start()
+
+    def add_callback(self, callback: Callable[[str], None]) -> None:
+        """Register in-process consumer of events (e.g. cache invalidation), subscription is started."""
+
+        self._callbacks.append(callback)
+        self.start()
+
+    def subscribe(self) -> Queue:
+        """Register new client and return queue which will receive all events."""
+
+        queue: Queue = Queue(maxsize=EVENTS_QUEUE_SIZE)
+
+        with self._lock:
+            self._listeners.add(queue)
+
+        # Redis subscription is created lazily with the first client
+        self.start()
+        return queue
+
+    def unsubscribe(self, queue: Queue) -> None:
+        """Unregister client queue."""
+
+        with self._lock:
+            self._listeners.discard(queue)
+
+    def publish_locally(self, data: str, internal: bool = False) -> None:
+        """Pass event to in-process callbacks and copy it into queues of all connected clients
+        (slow clients will miss the event), internal events are not passed to clients.
+        """
+
+        for callback in self._callbacks:
+            try:
+                callback(data)
+            except Exception as exc:
+                logging.error(f'Menu event callback failed with exception: {str(exc)}.')
+
+        if internal:
+            return
+
+        with self._lock:
+            listeners: list = list(self._listeners)
+
+        for queue in listeners:
+            try:
+                queue.put_nowait(data)
+            except Full:
+                logging.debug('Dropping menu event for slow client.')
+
+    def _listen(self) -> None:
+        """Consume Redis subscription forever, subscription is renewed when connection fails."""
+
+        while True:
+            try:
+                pubsub = get_redis_client().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel, *self._internal_channels)
+
+                for message in pubsub.listen():
+                    data = message['data']
+                    channel = message['channel']
+                    self.publish_locally(data.decode('utf-8') if isinstance(data, bytes) else str(data),
+                                         internal=_decode(channel) in self._internal_channels)
+            except Exception as exc:
+                logging.error(f'Subscription to menu events failed with exception: {str(exc)}.')
+                time.sleep(_RECONNECT_DELAY)
+
+    def stream(self, heartbeat: int = EVENTS_HEARTBEAT) -> Iterator[str]:
+        """Generate Server-Sent Events for a single client until the client disconnects."""
+
+        queue: Queue = self.subscribe()
+
+        try:
+            yield f'retry: {_RECONNECT_DELAY * 1000}\n\n'
+
+            while True:
+                try:
+                    data: str = queue.get(timeout=heartbeat)
+                except Empty:
+                    yield ': keep-alive\n\n'  # Comment line keeps proxies from closing idle connection
+                    continue
+
+                yield f'event: menu-update\ndata: {data}\n\n'
+        finally:
+            self.unsubscribe(queue)
+
+
+# Global broadcaster instance (one Redis subscription per process)
+broadcaster: MenuEventsBroadcaster = MenuEventsBroadcaster()
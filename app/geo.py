@@ -0,0 +1,80 @@
+"""
+Geo
+===
+
+Module containing location helpers: cached coordinates of addresses and spatial index of restaurants.
+
+Coordinates are geocoded once offline (see `geocode.py`) and stored in the coordinates file, restaurants
+are indexed in Redis GEO set, so nearby restaurants are found without scanning the whole registry.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+
+from functools import lru_cache
+from redis import Redis
+from config import COORDINATES_FILE, DEFAULT_SEARCH_RADIUS, OFFICES
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Dict, List, Optional, Tuple
+
+
+COORDINATES_PATH: str = os.path.join(os.path.dirname(os.path.realpath(__file__)), COORDINATES_FILE)
+
+# Redis key of the GEO set containing locations of restaurants (members are restaurant IDs)
+RESTAURANTS_GEO_KEY: str = 'restaurants-geo'
+
+
+@lru_cache(maxsize=None)
+def load_coordinates() -> Dict[str, Tuple[float, float]]:
+    """Load cached coordinates (latitude, longitude) of geocoded addresses."""
+
+    if not os.path.exists(COORDINATES_PATH):
+        return {}
+
+    with open(COORDINATES_PATH, 'r', encoding='utf-8') as coordinates_file:
+        return {address: tuple(location) for address, location in json.load(coordinates_file).items()}
+
+
+def address_coordinates(address: str) -> Optional[Tuple[float, float]]:
+    """Coordinates of the address (`None` if the address was not geocoded yet)."""
+
+    return load_coordinates().get(address)
+
+
+def office_location(office: str) -> Tuple[float, float, int]:
+    """Latitude, longitude and search radius of the office."""
+
+    if office not in OFFICES:
+        raise KeyError(f'Unknown office: {office}')
+
+    coordinates: Optional[Tuple[float, float]] = address_coordinates(OFFICES[office]['address'])
+    if coordinates is None:
+        raise ValueError(f'Office {office} was not geocoded yet.')
+
+    return coordinates[0], coordinates[1], OFFICES[office].get('radius', DEFAULT_SEARCH_RADIUS)
+
+
+def index_locations(client: Redis, locations: Dict[int, Tuple[float, float]]) -> int:
+    """Store locations (latitude, longitude) of restaurants to the spatial index, returns amount of indexed ones."""
+
+    if not locations:
+        return 0
+
+    values: list = []
+    for restaurant_id, (latitude, longitude) in locations.items():
+        values.extend((longitude, latitude, restaurant_id))
+
+    client.geoadd(RESTAURANTS_GEO_KEY, *values)
+    return len(locations)
+
+
+def find_nearby(client: Redis, latitude: float, longitude: float, radius: int) -> List[Tuple[int, float]]:
+    """Find restaurants within radius (meters), returns their IDs and distances sorted from the nearest."""
+
+    results: list = client.georadius(RESTAURANTS_GEO_KEY, longitude, latitude, radius, unit='m',
+                                     withdist=True, sort='ASC')
+    return [(int(restaurant_id), distance) for restaurant_id, distance in results]
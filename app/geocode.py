@@ -0,0 +1,72 @@
+"""
+Geocode
+=======
+
+Offline tool geocoding addresses of all restaurants and offices into the coordinates file.
+
+Only addresses which are not cached yet are geocoded (using OpenStreetMap Nominatim). Run it after
+adding a restaurant or an office: `python geocode.py`.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import time
+
+import requests
+
+from geo import COORDINATES_PATH, load_coordinates
+from restaurants import RESTAURANTS
+from config import OFFICES
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Dict, List, Optional, Tuple
+
+
+NOMINATIM_URL: str = 'https://nominatim.openstreetmap.org/search'
+NOMINATIM_DELAY: float = 1.0  # Usage policy allows at most one request per second
+
+
+def geocode(address: str) -> Optional[Tuple[float, float]]:
+    """Resolve address to coordinates (latitude, longitude), `None` if the address was not found."""
+
+    response: requests.Response = requests.get(
+        NOMINATIM_URL, params={'q': address, 'format': 'json', 'limit': 1},
+        headers={'User-Agent': 'Mergado-food-BE geocoder'}, timeout=10,
+    )
+    response.raise_for_status()
+
+    results: list = response.json()
+    if not results:
+        return None
+
+    return float(results[0]['lat']), float(results[0]['lon'])
+
+
+def main() -> None:
+    coordinates: Dict[str, Tuple[float, float]] = dict(load_coordinates())
+    addresses: List[str] = [restaurant.full_address() for restaurant in RESTAURANTS]
+    addresses += [office['address'] for office in OFFICES.values()]
+
+    for address in addresses:
+        if address in coordinates:
+            continue
+
+        location: Optional[Tuple[float, float]] = geocode(address)
+        if location is None:
+            logging.warning(f'Address "{address}" was not found.')
+        else:
+            coordinates[address] = location
+            logging.info(f'Address "{address}" geocoded to {location}.')
+
+        time.sleep(NOMINATIM_DELAY)
+
+    with open(COORDINATES_PATH, 'w', encoding='utf-8') as coordinates_file:
+        json.dump(coordinates, coordinates_file, ensure_ascii=False, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
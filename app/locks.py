@@ -0,0 +1,93 @@
+"""
+Locks
+=====
+
+Module containing distributed (Redis based) lease locks used to coordinate scraping across processes.
+
+Every successful acquisition returns a fencing token (monotonically increasing number) so that the
+storage can reject writes from the holder whose lease has already expired.
+"""
+
+from __future__ import annotations
+
+import time
+import uuid
+
+from redis import Redis
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Optional
+
+
+# Acquire the lock or renew it when it is already held by the same owner, returns fencing token
+_ACQUIRE_SCRIPT: str = """
+local owner = redis.call('GET', KEYS[1])
+if owner == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return tonumber(redis.call('GET', KEYS[2]))
+end
+if owner then
+    return nil
+end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return redis.call('INCR', KEYS[2])
+"""
+
+# Delete the lock only when it is still held by the owner
+_RELEASE_SCRIPT: str = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaseLock:
+    """Lock held by a single owner until it is released or its lease (TTL) expires."""
+
+    def __init__(self, client: Redis, name: str, ttl: int, owner: Optional[str] = None) -> None:
+        self.client: Redis = client
+        self.name: str = name
+        self.ttl: int = ttl
+        self.owner: str = owner or uuid.uuid4().hex
+        self.token: Optional[int] = None
+
+    @property
+    def key(self) -> str:
+        return f'lock-{self.name}'
+
+    @property
+    def fencing_key(self) -> str:
+        return f'lock-{self.name}-fencing'
+
+    @property
+    def holder(self) -> Optional[str]:
+        """Owner currently holding the lock (`None` if the lock is free)."""
+
+        raw_owner: Optional[bytes] = self.client.get(self.key)
+        return raw_owner.decode('utf-8') if isinstance(raw_owner, bytes) else raw_owner
+
+    def acquire(self) -> Optional[int]:
+        """Try to acquire the lock (without waiting), returns fencing token or `None` if the lock is taken."""
+
+        token = self.client.eval(_ACQUIRE_SCRIPT, 2, self.key, self.fencing_key, self.owner, self.ttl * 1000)
+        self.token = int(token) if token is not None else None
+        return self.token
+
+    def acquire_wait(self, timeout: float, interval: float = 0.05) -> Optional[int]:
+        """Acquire the lock, waiting at most `timeout` seconds, returns fencing token or `None` on timeout."""
+
+        deadline: float = time.monotonic() + timeout
+        while self.acquire() is None:
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(interval)
+
+        return self.token
+
+    def release(self) -> bool:
+        """Release the lock, returns `False` if the lease already expired (or the lock is held by someone else)."""
+
+        self.token = None
+        return bool(self.client.eval(_RELEASE_SCRIPT, 1, self.key, self.owner))
@@ -0,0 +1,220 @@
+"""
+Profiling
+=========
+
+Module containing opt-in profiling (cProfile) of requests and scrapings.
+
+Profiles are stored in Redis (only the newest ones are kept) and can be downloaded as raw `pstats` data
+or as collapsed stacks (input of `flamegraph.pl`, speedscope...). Stacks are reconstructed from the call
+graph of cProfile, so time of functions called from several places is split by their callers.
+"""
+
+from __future__ import annotations
+
+import cProfile
+import logging
+import marshal
+import os
+import pstats
+import threading
+import time
+import traceback
+import uuid
+
+from collections import defaultdict
+from io import StringIO
+from redis import Redis
+from storage import _decode, get_redis_client
+from config import PROFILES_LIMIT, PROFILES_TTL
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Dict, List, Optional, Set, Tuple
+
+
+# Redis key containing IDs of stored profiles (the newest first)
+PROFILES_KEY: str = 'profiles'
+
+# Paths shorter than this are left out of collapsed stacks (seconds)
+_MIN_STACK_TIME: float = 1e-6
+_MAX_STACK_DEPTH: int = 200
+
+# Only one profiler can be active in the process: greenlets of gevent workers share one thread, so its profiler
+# would record all of them and the first stopped profile would silently end the others
+_active_lock: threading.Lock = threading.Lock()
+
+
+def profile_key(profile_id: str) -> str:
+    """Key of the hash containing the profile and its metadata."""
+
+    return f'profile-{profile_id}'
+
+
+def save_profile(client: Redis, name: str, stats: dict, duration: float) -> str:
+    """Store profile (`pstats` data) and drop the oldest ones over the limit, returns ID of the profile."""
+
+    profile_id: str = uuid.uuid4().hex
+    expired_ids: List[bytes] = client.lrange(PROFILES_KEY, PROFILES_LIMIT - 1, -1)
+
+    pipeline = client.pipeline()
+    pipeline.hset(profile_key(profile_id), mapping={
+        'name': name, 'created_at': time.time(), 'duration': duration, 'stats': marshal.dumps(stats),
+    })
+    pipeline.expire(profile_key(profile_id), PROFILES_TTL)
+    pipeline.lpush(PROFILES_KEY, profile_id)
+    pipeline.ltrim(PROFILES_KEY, 0, PROFILES_LIMIT - 1)
+    for expired_id in expired_ids:
+        pipeline.delete(profile_key(_decode(expired_id)))
+    pipeline.execute()
+
+    return profile_id
+
+
+def list_profiles(client: Redis) -> List[dict]:
+    """Metadata of stored profiles (the newest first)."""
+
+    profile_ids: List[str] = [_decode(profile_id) for profile_id in client.lrange(PROFILES_KEY, 0, -1)]
+
+    pipeline = client.pipeline()
+    for profile_id in profile_ids:
+        pipeline.hmget(profile_key(profile_id), 'name', 'created_at', 'duration')
+
+    profiles: List[dict] = []
+    for profile_id, (name, created_at, duration) in zip(profile_ids, pipeline.execute()):
+        if name is None:
+            continue  # Profile already expired
+
+        profiles.append({
+            'id': profile_id, 'name': _decode(name), 'created_at': float(created_at), 'duration': float(duration),
+        })
+
+    return profiles
+
+
+def load_profile(client: Redis, profile_id: str) -> Optional[bytes]:
+    """Load raw `pstats` data of the profile (`None` if it does not exist)."""
+
+    return client.hget(profile_key(profile_id), 'stats')
+
+
+def _label(func: Tuple[str, int, str]) -> str:
+    """Frame label of the function in collapsed stacks."""
+
+    filename, line, name = func
+    if filename == '~':
+        return name.replace(';', ',')  # Built-in function
+
+    path: str = '/'.join(filename.split(os.sep)[-2:])
+    return f'{name} ({path}:{line})'.replace(';', ',')
+
+
+def collapsed_stacks(raw_stats: bytes) -> str:
+    """Convert raw `pstats` data to collapsed stacks (one `frame;frame;frame microseconds` per line)."""
+
+    stats: dict = marshal.loads(raw_stats)
+
+    callees: Dict[tuple, List[tuple]] = defaultdict(list)
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller in callers:
+            callees[caller].append(func)
+
+    samples: Dict[str, float] = defaultdict(float)
+
+    def walk(func: tuple, stack: Tuple[str, ...], seen: Set[tuple], fraction: float) -> None:
+        """Add the function (`fraction` of its time belongs to the stack) and walk its callees."""
+
+        self_time: float = stats[func][2]
+        stack = stack + (_label(func),)
+        samples[';'.join(stack)] += self_time * fraction
+
+        if len(stack) >= _MAX_STACK_DEPTH:
+            return
+
+        for callee in callees.get(func, []):
+            callee_cumulative: float = stats[callee][3]
+            edge_cumulative: float = stats[callee][4][func][3]  # Time of the callee when called by the function
+            if callee in seen or callee_cumulative <= 0 or edge_cumulative * fraction < _MIN_STACK_TIME:
+                continue
+
+            walk(callee, stack, seen | {callee}, fraction * edge_cumulative / callee_cumulative)
+
+    for root in [func for func, value in stats.items() if not value[4]]:
+        walk(root, (), {root}, 1.0)
+
+    return ''.join(f'{stack} {round(seconds * 1_000_000)}\n'
+                   for stack, seconds in samples.items() if round(seconds * 1_000_000) > 0)
+
+
+def raw_stats_summary(raw_stats: bytes, limit: int = 30) -> str:
+    """Human readable summary of raw `pstats` data (functions with the highest cumulative time)."""
+
+    output: StringIO = StringIO()
+    stats: pstats.Stats = pstats.Stats(stream=output)
+    stats.stats = marshal.loads(raw_stats)
+    stats.get_top_level_stats()
+    stats.sort_stats('cumulative').print_stats(limit)
+
+    return output.getvalue()
+
+
+class Profile:
+    """Profile code between `start` and `stop` (or in the `with` block) and store the result to Redis.
+
+    Profiling is skipped when it is not enabled or some other profile is already running in the process.
+    """
+
+    def __init__(self, name: str, enabled: bool = True) -> None:
+        self.name: str = name
+        self.enabled: bool = enabled
+        self.profile_id: Optional[str] = None
+        self._profiler: Optional[cProfile.Profile] = None
+        self._start_time: float = 0.0
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+
+        if not _active_lock.acquire(blocking=False):
+            logging.warning(f'Profiling of {self.name} was skipped, other profile is already running.')
+            return
+
+        self._profiler = cProfile.Profile()
+        try:
+            self._profiler.enable()
+        except ValueError as exc:
+            # Other profiling tool (e.g. debugger) is already active
+            logging.warning(f'Profiling of {self.name} was skipped: {str(exc)}.')
+            self._profiler = None
+            _active_lock.release()
+            return
+
+        self._start_time = time.perf_counter()
+
+    def stop(self) -> Optional[str]:
+        """Stop profiling and store the profile, returns its ID (`None` if nothing was profiled)."""
+
+        if self._profiler is None:
+            return None
+
+        self._profiler.disable()
+        duration: float = time.perf_counter() - self._start_time
+        _active_lock.release()
+
+        try:
+            self._profiler.create_stats()
+            self.profile_id = save_profile(get_redis_client(), self.name, self._profiler.stats, duration)
+            logging.info(f'Profile {self.profile_id} of {self.name} was stored ({duration:.3f}s).')
+        except Exception as exc:
+            logging.error(f'Storing profile of {self.name} failed with exception: {str(exc)}.')
+            logging.debug(f'Exception trace for profile of {self.name}: {traceback.format_exc()}.')
+        finally:
+            self._profiler = None
+
+        return self.profile_id
+
+    def __enter__(self) -> Profile:
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
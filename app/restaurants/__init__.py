@@ -11,7 +11,18 @@ import logging
 import time
 import traceback
 
+from encoding import compress_variants, dumps_json
+from geo import find_nearby, index_locations
+from profiling import Profile
+from storage import get_redis_client, load_snapshots, save_day_views
+from flask_restful import fields
+from utility import MappingField, MarshalWith, WeekDays
+from config import DAY_VIEWS_LOCK_TTL, PROFILE_SCRAPES
+from locks import LeaseLock
 from .base_restaurant import BaseRestaurant
+from .dishes import dish_index
+from .models import RestaurantMeal
+from .resilience import CircuitOpenError, ResilientScrape
 from .budha import BudhaRestaurant
 from .chilli_tree import ChillTreeRestaurant
 from .die_cuche import DieChucheRestaurant
@@ -27,7 +38,9 @@ from .vesela_cajovna import VeselaCajovnaRestaurant
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
-    from typing import List, Type, Optional
+    from datetime import timedelta
+    from redis import Redis
+    from typing import Dict, List, Type, Optional, Tuple
 
 
 # After how much time we can do scraping
@@ -41,81 +54,208 @@ RESTAURANTS: List[Type] = [
     ThalieRestaurant, UTrechCertuRestaurant, VeselaCajovnaRestaurant,
 ]
 
+# Scraping statuses which are counted as failures
+FAILED_STATUSES: List[str] = ['failed', 'skipped']
+
+# Restaurant classes by their unique identifiers
+RESTAURANTS_BY_ID: Dict[int, Type[BaseRestaurant]] = {restaurant.restaurant_id(): restaurant for restaurant in RESTAURANTS}
+
+# Response with restaurants data, shared by the API and precomputed views (so both are identical)
+RESTAURANTS_RESPONSE: MarshalWith = MarshalWith({
+    'loaded_scrapers': fields.Integer,
+    'data_size': fields.Integer,
+    'data': fields.List(fields.Nested(BaseRestaurant.RESTAURANT_FIELDS)),
+})
+
+# Compact variant of the response, meals are references to dishes (see `RestaurantMeal.to_reference`)
+RESTAURANTS_COMPACT_RESPONSE: MarshalWith = MarshalWith({
+    'loaded_scrapers': fields.Integer,
+    'data_size': fields.Integer,
+    'data': fields.List(fields.Nested(dict(BaseRestaurant.RESTAURANT_FIELDS,
+                                           meals=MappingField(fields.List(fields.Raw))))),
+})
+
+
 class RestaurantsFactory:
     """Simple restaurant manager."""
 
     @staticmethod
-    def execute_scraping(force_scraping: bool) -> int:
-        """Start scraping on all avalible scrapers/restaurants."""
+    def scrape_restaurant(restaurant: Type[BaseRestaurant], force_scraping: bool) -> dict:
+        """Scrape and save a single restaurant, never raises.
 
-        failed_scrapings: int = 0
-        accum_time: float = 0
+        Returns result with `restaurant` name, `status` (`success`, `failed`, `fresh`, `busy`, `skipped`)
+        and `duration` of the scraping.
+        """
 
-        for restaurant in RESTAURANTS:
-            start_time: float = time.time()
-            fail_already_detected: bool = False
-            errors_count: int = 0
-            restaurant_name: str = None
-            restaurant_instance: Optional[BaseRestaurant] = None
+        start_time: float = time.time()
+        status: str = 'failed'
+        restaurant_name: str = None
+        lock: Optional[LeaseLock] = None
 
-            try:
-                restaurant_instance = restaurant(init_scaper=True)
-                restaurant_name = restaurant_instance.name
-                logging.info(f'Starting scraping for restauran {restaurant_instance.name}.')
-                time_diff: datetime = datetime.now() - restaurant_instance.last_scraping
-                restaurant_instance.last_scraping = datetime.now()
-
-                if force_scraping or time_diff.second > SCRAPING_INTERVAL:
-                    fail_already_detected = not restaurant_instance.scrape()
-                    failed_scrapings += int(fail_already_detected)
-                    restaurant_instance.save_meals()  # Save scraped data
-            except Exception as exc:
-                if not fail_already_detected:
-                    failed_scrapings += 1
+        try:
+            restaurant_instance: BaseRestaurant = restaurant(ignore_loading=True)
+            restaurant_name = restaurant_instance.name
+            logging.info(f'Starting scraping for restauran {restaurant_instance.name}.')
+            time_diff: timedelta = datetime.now() - restaurant_instance.last_scraping
+
+            lock = restaurant_instance.scraping_lock()
+            if not force_scraping and time_diff.total_seconds() <= SCRAPING_INTERVAL:
+                logging.info(f'Data for restaurant {restaurant_name} are still fresh, skipping.')
+                status = 'fresh'
+            elif lock.acquire() is None:
+                # Coalesce with scraping which is already in progress (other worker or load request)
+                logging.info(f'Restaurant {restaurant_name} is already being scraped, skipping.')
+                status = 'busy'
+            else:
+                restaurant_instance.fencing_token = lock.token
+                with Profile(f'scrape {restaurant_name}', enabled=PROFILE_SCRAPES):
+                    # Scraping is retried, skipped for broken sites and supervised (browser is always quit)
+                    status = 'success' if ResilientScrape(restaurant_instance).run() else 'failed'
+                    if status == 'success':
+                        # Partial data of failed scraping would overwrite good days, it is retried next time
+                        restaurant_instance.save_meals()  # Save scraped data (with the time of scraping)
+        except CircuitOpenError as exc:
+            status = 'skipped'
+            logging.warning(f'Scraping for restaurant {restaurant_name} skipped: {str(exc)}.')
+        except Exception as exc:
+            status = 'failed'
+            if not restaurant_name:
+                logging.error(f'Was not able to instanciate {restaurant.__name__}.')
+                restaurant_name = f'CLASS-{restaurant.__name__}'
 
-                if not restaurant_name:
-                    logging.error(f'Was not able to instanciate {restaurant.__name__}.')
-                    restaurant_name = f'CLASS-{restaurant.__name__}'
+            logging.error(f'Scraping for restaurant {restaurant_name} failed with exception: {str(exc)}.')
+            logging.debug(f'Exception trace for restaurant {restaurant_name}: {traceback.format_exc()}.')
+        finally:
+            if lock is not None and lock.token is not None:
+                lock.release()
 
-                logging.error(f'Scraping for restaurant {restaurant_name} failed with exception: {str(exc)}.')
-                logging.debug(f'Exception trace for restaurant {restaurant_name}: {traceback.format_exc()}.')
+        time_diff: float = time.time() - start_time
+        logging.info(f'Scraping for restaurant {restaurant_name} was done in {time_diff:.2f}.')
 
-            time_diff: float = time.time() - start_time
-            accum_time += time_diff
-            logging.info(f'Scraping for restaurant {restaurant_name} was done in {time_diff:.2f}.')
-        logging.info(f'Scraping task was done in {accum_time} with {errors_count} errors.')
+        return {'restaurant': restaurant_name, 'status': status, 'duration': time_diff}
+
+    @staticmethod
+    def build_day_views() -> int:
+        """Precompute serialized (and compressed) responses with all restaurants for every day (and the whole
+        week), so requests without other filters are served by a single key lookup. Returns amount of built views.
 
-        return failed_scrapings
+        Snapshot is read and views are written under the lock, so views written the last always contain all
+        data saved before (concurrent builds of other restaurants never overwrite them by older snapshots).
+        """
 
+        lock: LeaseLock = LeaseLock(get_redis_client(), 'day-views', DAY_VIEWS_LOCK_TTL)
+        if lock.acquire_wait(DAY_VIEWS_LOCK_TTL) is None:
+            raise TimeoutError('Lock of day views was not acquired in time.')
+
+        try:
+            return RestaurantsFactory._build_day_views()
+        finally:
+            lock.release()
 
     @staticmethod
-    def get_restaurants_data(day: Optional[str], restaurant_name: Optional[int]) -> list:
-        """Retrieve all restaurants data based on day and restaurant (hash ID of the restaurant) filter."""
+    def _build_day_views() -> int:
+        """Build and store day views from the current snapshot (lock of day views has to be held)."""
 
-        _restaurant_name: str = None
-        restaurant_instance: Optional[BaseRestaurant] = None
-        resulting_restaurants: list = []
+        restaurant_instances: List[BaseRestaurant] = [
+            restaurant_instance for restaurant_instance, _ in RestaurantsFactory.get_restaurants_snapshots().values()
+        ]
+
+        views: Dict[Optional[str], Dict[str, bytes]] = {}
+        for day in [None] + WeekDays.all_days():
+            data: List[dict] = [restaurant_instance.to_dict(day) for restaurant_instance in restaurant_instances]
+            views[day] = compress_variants(dumps_json(RESTAURANTS_RESPONSE.marshal({
+                'loaded_scrapers': len(RESTAURANTS),
+                'data_size': len(data),
+                'data': data,
+            })))
+
+        save_day_views(get_redis_client(), views)
+        return len(views)
+
+    @staticmethod
+    def filter_restaurants(restaurant_name: Optional[str] = None) -> List[Type[BaseRestaurant]]:
+        """Retrieve restaurant classes matching the name filter (no instance is created)."""
+
+        if not restaurant_name:
+            return list(RESTAURANTS)
+
+        return [restaurant for restaurant in RESTAURANTS
+                if restaurant_name.replace(' ', '') in restaurant._NAME.replace(' ', '')]
+
+    @staticmethod
+    def index_locations() -> int:
+        """Store locations of all geocoded restaurants to the spatial index, returns amount of indexed ones."""
 
+        locations: Dict[int, Tuple[float, float]] = {}
         for restaurant in RESTAURANTS:
-            try:
-                restaurant_instance = restaurant()
-                _restaurant_name = restaurant_instance.name
+            location: Optional[Tuple[float, float]] = restaurant.location()
+            if location is None:
+                logging.warning(f'Restaurant {restaurant._NAME} is not geocoded, run `geocode.py`.')
+                continue
+            locations[restaurant.restaurant_id()] = location
 
-                if restaurant_name and restaurant_name.replace(' ', '') not in restaurant_instance.name.replace(' ', ''):
-                    continue  # Filtering by name
+        return index_locations(get_redis_client(), locations)
 
-                resulting_restaurants.append(restaurant_instance.to_dict(day))
+    @staticmethod
+    def find_nearby(latitude: float, longitude: float, radius: int) -> List[Tuple[Type[BaseRestaurant], float]]:
+        """Retrieve restaurant classes within radius (meters) with their distances, sorted from the nearest."""
 
-            except Exception as exc:
-                if not _restaurant_name:
-                    logging.error(f'Was not able to instanciate {restaurant.__name__}.')
-                    _restaurant_name = f'CLASS-{restaurant.__name__}'
+        return [(RESTAURANTS_BY_ID[restaurant_id], distance)
+                for restaurant_id, distance in find_nearby(get_redis_client(), latitude, longitude, radius)
+                if restaurant_id in RESTAURANTS_BY_ID]
+
+    @staticmethod
+    def get_restaurant_data(restaurant: Type[BaseRestaurant], day: Optional[str]) -> dict:
+        """Retrieve data of a single restaurant, only the requested day is loaded."""
+
+        restaurant_instance: BaseRestaurant = restaurant(ignore_loading=True)
+        restaurant_instance.load_meals(day=day)
+        return restaurant_instance.to_dict(day)
+
+    @staticmethod
+    def get_restaurants_snapshots(restaurants: Optional[List[Type[BaseRestaurant]]] = None
+                                  ) -> Dict[Type[BaseRestaurant], Tuple[BaseRestaurant, Dict[str, int]]]:
+        """Load restaurants (all of them by default) with their meals and versions of days in one bulk fetch,
+        details of all referenced dishes are loaded at once too.
+        """
+
+        restaurants = RESTAURANTS if restaurants is None else restaurants
+        client: Redis = get_redis_client()
+        snapshots: Dict[int, dict] = load_snapshots(
+            client, {restaurant.restaurant_id(): restaurant._NAME for restaurant in restaurants}
+        )
 
-                logging.error(f'Loading restaurant {_restaurant_name} failed with exception: {str(exc)}.')
-                logging.debug(f'Exception trace for restaurant {_restaurant_name}: {traceback.format_exc()}.')
+        for snapshot in snapshots.values():
+            snapshot['days'] = RestaurantMeal.decode_days(snapshot['days'])
+        dishes: Dict[str, dict] = dish_index.get_many(client, [
+            dish_id for snapshot in snapshots.values() for dish_id in RestaurantMeal.dish_references(snapshot['days'])
+        ])
+
+        resulting_restaurants: dict = {}
+        for restaurant in restaurants:
+            # Connection was already checked by the bulk fetch
+            restaurant_instance: BaseRestaurant = restaurant(ignore_loading=True, check_connection=False)
+            snapshot: dict = snapshots[restaurant.restaurant_id()]
+            restaurant_instance.restore_snapshot(snapshot, dishes)
+            resulting_restaurants[restaurant] = (restaurant_instance, snapshot['versions'])
+
+        return resulting_restaurants
+
+    @staticmethod
+    def get_restaurants_data(day: Optional[str], restaurant_name: Optional[str]) -> list:
+        """Retrieve all restaurants data based on day and restaurant (name of the restaurant) filter."""
+
+        resulting_restaurants: list = []
+
+        for restaurant in RestaurantsFactory.filter_restaurants(restaurant_name):
+            try:
+                resulting_restaurants.append(RestaurantsFactory.get_restaurant_data(restaurant, day))
+            except Exception as exc:
+                logging.error(f'Loading restaurant {restaurant._NAME} failed with exception: {str(exc)}.')
+                logging.debug(f'Exception trace for restaurant {restaurant._NAME}: {traceback.format_exc()}.')
                 continue
 
         return resulting_restaurants
 
 
-__all__ = ('BaseRestaurant', 'RestaurantsFactory')
+__all__ = ('BaseRestaurant', 'RestaurantMeal', 'RestaurantsFactory', 'RESTAURANTS_COMPACT_RESPONSE', 'RESTAURANTS_RESPONSE')
@@ -1,106 +1,48 @@
 from __future__ import annotations
 
-import json
+import hashlib
 import logging
 
 from datetime import datetime
 from flask_restful import fields
 from redis import Redis
 from abc import abstractmethod
-from utility import WeekDays, create_brno_like_address
-from config import REDIS_PORT, REDIS_SERVICE
-from selenium.webdriver import Chrome
-from selenium.webdriver.chrome.options import Options
+from archive import menu_archive
+from geo import address_coordinates
+from utility import BRNO_CITY_CODE_ADDRESS, MappingField, WeekDays, create_address
+from config import SCRAPING_LOCK_TTL
+from locks import LeaseLock
+from storage import (
+    get_redis_client, last_scraping_key, load_days, load_versions, publish_menu_update, save_days
+)
+from .dishes import dish_index
+from .models import RestaurantMeal
+from .resilience import ResilientScrape
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
-    from typing import List, Optional, Dict, Union
+    from typing import List, Optional, Dict, Tuple
+    from selenium.webdriver import Chrome
 
 
 _UNKNOWN_VALUE: str = 'Unknown Value'
 
 
-class RestaurantMeal:
-
-    MEAL_FIELDS: dict = {
-        'name': fields.String, 'price': fields.Float, 'description': fields.String,
-        'alergens': fields.List(fields.String), 'is_vegan': fields.Boolean,
-        'is_gluten_free': fields.Boolean, 'is_soup': fields.Boolean,
-    }
-
-    # NOTE: Float is not the best type for curency butt here it should do the job
-    def __init__(self, name: str, price: float, description: Optional[str], alergens: Optional[List[str]],
-                 is_vegan: bool = False, is_gluten_free: bool = False, is_soup: bool = False) -> None:
-        self.name: str = name
-        self.price: float = price
-        self.description: str = description
-        self.alergens: List['str'] = alergens
-        self.is_vegan: bool = is_vegan
-        self.is_gluten_free: bool = is_gluten_free
-        self.is_soup: bool = is_soup
-
-    def to_dict(self) -> dict:
-        """Returns meal as dictonary."""
-
-        return {
-            'name': self.name,
-            'price': self.price,
-            'description': self.description,
-            'alergens': self.alergens,
-            'is_vegan': self.is_vegan,
-            'is_gluten_free': self.is_gluten_free,
-            'is_soup': self.is_soup,
-        }
-
-    @staticmethod
-    def from_dict(raw_dict: dict) -> RestaurantMeal:
-        """Deserialize meal from the dict."""
-
-        return RestaurantMeal(raw_dict.get('name', 'ERROR'), raw_dict.get('price', 0.0), raw_dict.get('description', ''),
-                              raw_dict.get('alergens', []), raw_dict.get('is_vegan', False),
-                              raw_dict.get('is_gluten_free', False), raw_dict.get('is_soup', False))
-
-    @staticmethod
-    def serialize_meals(data: Dict[str, List[RestaurantMeal]]) -> str:
-        """Serialize meal to dict."""
-
-        data_copy: Dict[str, List[dict]] = {}
-
-        for day, meals in data.items():
-            if isinstance(day, tuple):
-                day = day[0]
-            data_copy[str(day)] = list(map(lambda meal: meal.to_dict(), meals))
-
-        return json.dumps(data_copy)
-
-    @staticmethod
-    def deserialize_meals(raw_meals: str) -> Dict[str, List[RestaurantMeal]]:
-        """Try to get meals from Redis based on `restaurant_id`."""
-
-        return_data: Dict[str, List[dict]] = {}
-
-        for day, meals in json.loads(raw_meals).items():
-            if isinstance(day, tuple):
-                day = day[0]
-            meals = list(map(lambda meal_raw: RestaurantMeal.from_dict(meal_raw), meals))
-            return_data[day] = meals
-
-        return return_data
-
-
 class BaseRestaurant:
 
     RESTAURANT_FIELDS: dict = {
         'name': fields.String, 'url': fields.String, 'accepts_cards': fields.Boolean, 'last_scrape': fields.String,
-        'meals': fields.Nested(fields.Nested(RestaurantMeal.MEAL_FIELDS))
+        'address': fields.String, 'distance': fields.Float,
+        'meals': MappingField(fields.List(fields.Nested(RestaurantMeal.MEAL_FIELDS)))
     }
 
     _ADDRESS: str = _UNKNOWN_VALUE
+    _CITY: str = BRNO_CITY_CODE_ADDRESS
     _URL: str = _UNKNOWN_VALUE
     _NAME: str = _UNKNOWN_VALUE
     _ACCEPTS_CARD: bool = False
 
-    # Creating empty meals
+    # Creating empty meals (every instance gets its own copy in `__init__`)
     MEALS: Dict[str, List[RestaurantMeal]] = dict(map(lambda day: (day, []), WeekDays.all_days()))
 
     def _init_scrapers(self) -> None:
@@ -109,6 +51,10 @@ class BaseRestaurant:
         if self.web_driver is not None:
             return  # It is already initialised.
 
+        # NOTE: Selenium is imported lazily, so the web tier does not pay for it
+        from selenium.webdriver import Chrome
+        from selenium.webdriver.chrome.options import Options
+
         chrome_options: Options = Options()
         chrome_options.add_argument("--no-sandbox")
         chrome_options.add_argument("--headless")
@@ -124,16 +70,20 @@ class BaseRestaurant:
         logging.info(f'Startig scraping for page "{self.web_driver.title}".')
 
 
-    def __init__(self, force_scrape: bool = False, ignore_loading: bool = False, init_scaper: bool = False) -> None:
+    def __init__(self, force_scrape: bool = False, ignore_loading: bool = False, init_scaper: bool = False,
+                 check_connection: bool = True) -> None:
         self._last_scraping: Optional[datetime] = None
         self.web_driver: Optional[Chrome] = None
+        self.fencing_token: Optional[int] = None  # Token of the scraping lock used when meals are saved
+        self.reset_meals()
 
         if init_scaper:
             self._init_scrapers()
 
-        self.redis_client: Redis = Redis(host=REDIS_SERVICE, port=REDIS_PORT, decode_responses=False)
-        # If the client does not response directly kill app by exception
-        self.redis_client.ping()
+        self.redis_client: Redis = get_redis_client()
+        if check_connection:
+            # If the client does not response directly kill app by exception
+            self.redis_client.ping()
 
         _reqired_data: List[str] = [self._ADDRESS, self._URL, self._NAME]
         if _UNKNOWN_VALUE in _reqired_data:
@@ -143,11 +93,30 @@ class BaseRestaurant:
         # If we are creating instance for scraping we do not need to load data which we will instantly
         # replace by  new one.
         if not ignore_loading:
-            self.load_meals(force_scrape=force_scrape)  # Load meals from redis, or scrape them
+            self.load_meals(force_scrape=force_scrape)  # Load meals from redis, or scrape them when forced
+
+    def close_scrapers(self) -> None:
+        """Quit selenium scraper (browser with all its processes)."""
+
+        if self.web_driver is None:
+            return
+
+        try:
+            self.web_driver.quit()
+        except Exception as exc:
+            logging.error(f'Was not able to quit browser for restaurant {self.name}: {str(exc)}.')
+        finally:
+            self.web_driver = None
+
+    def __enter__(self) -> BaseRestaurant:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close_scrapers()
 
     def __del__(self):
-        if self.web_driver is not None:
-            self.web_driver.close()
+        # NOTE: This is only the last resort, `close_scrapers` should be called explicitly
+        self.close_scrapers()
 
     @property
     def address(self) -> str:
@@ -155,7 +124,19 @@ class BaseRestaurant:
 
         if self._ADDRESS == _UNKNOWN_VALUE:
             raise ValueError('Getting address from uninitialised restaurant.')
-        return create_brno_like_address(self._ADDRESS)
+        return self.full_address()
+
+    @classmethod
+    def full_address(cls) -> str:
+        """Restaurant address including the city, no instance is needed."""
+
+        return create_address(cls._ADDRESS, cls._CITY)
+
+    @classmethod
+    def location(cls) -> Optional[Tuple[float, float]]:
+        """Geocoded coordinates (latitude, longitude) of the restaurant, `None` if it was not geocoded yet."""
+
+        return address_coordinates(cls.full_address())
 
     @property
     def accept_cards(self) -> bool:
@@ -169,41 +150,70 @@ class BaseRestaurant:
 
         return self._NAME
 
+    @classmethod
+    def restaurant_id(cls) -> int:
+        """Unique identifier for the restaurant (stable across processes), no instance is needed."""
+
+        return int(hashlib.sha1(f'{cls._URL}-{cls._NAME}'.encode('utf-8')).hexdigest()[:15], 16)
+
     @property
     def _hash(self) -> int:
-        """Unique identifier for the restaurant."""
+        """Unique identifier for the restaurant (stable across processes)."""
 
-        return hash(f'{self._URL}-{self.name}')
+        return self.restaurant_id()
 
     @property
-    def meals(self, day: Optional[str] = None) -> Union[List[RestaurantMeal], List[Dict[str, List[RestaurantMeal]]]]:
-        """Retrieve meals for the specific day."""
+    def meals(self) -> Dict[str, List[RestaurantMeal]]:
+        """Retrieve meals for the whole week."""
+
+        return self.MEALS
 
-        # Day is not specified, so we would take it as whole
-        if not day:
-            return self.MEALS
+    def day_meals(self, day: str) -> List[RestaurantMeal]:
+        """Retrieve meals for the specific day."""
 
         if not WeekDays.is_valid_day(day) and day not in self.MEALS.keys():
             raise KeyError(f'Unknown day: {day}')
         retrieved_data: List[RestaurantMeal] = self.MEALS.get(day, [])
         if not retrieved_data:
-            self.load_meals()  # Attempt to load if not already loaed
+            self.load_meals(day=day)  # Attempt to load if not already loaed
         return self.MEALS.get(day, [])
 
     @property
     def last_scraping(self) -> datetime:
         """Retrieve last datetime when was scraping executed."""
 
-        redis_key: str = f'{self.name.replace(" ", "")}-{self._hash}-last_scraping'
+        redis_key: str = last_scraping_key(self._hash, self.name)
 
         # Attempt to fetch
         if not self._last_scraping:
-            self._last_scraping = self.redis_client.get(redis_key)
+            raw_timestamp: Optional[bytes] = self.redis_client.get(redis_key)
+            if raw_timestamp:
+                self._last_scraping = datetime.fromtimestamp(float(raw_timestamp))
 
         if not self._last_scraping:
             return datetime.fromtimestamp(0)  # Scraping does not exists
         return self._last_scraping
 
+    @last_scraping.setter
+    def last_scraping(self, value: datetime) -> None:
+        """Store datetime of the last scraping."""
+
+        redis_key: str = last_scraping_key(self._hash, self.name)
+
+        self._last_scraping = value
+        self.redis_client.set(redis_key, value.timestamp())
+
+    @property
+    def meals_versions(self) -> Dict[str, int]:
+        """Retrieve version counters of stored meals for every day."""
+
+        return load_versions(self.redis_client, self._hash)
+
+    def scraping_lock(self) -> LeaseLock:
+        """Create lock guarding scraping of this restaurant across all workers."""
+
+        return LeaseLock(self.redis_client, f'restaurant-{self._hash}', SCRAPING_LOCK_TTL)
+
     @abstractmethod
     def scrape(self) -> bool:
         """Callback method for scraping."""
@@ -215,12 +225,10 @@ class BaseRestaurant:
 
         meals_data: dict = {}
         if day:
-            _meals: list = list(map(lambda meal: meal.to_dict(), self.meals(day=str(day))))
+            _meals: list = list(map(lambda meal: meal.to_dict(), self.MEALS.get(str(day), [])))
             meals_data[str(day)] = _meals
         else:
             for _day, _meals in self.meals.items():
-                if isinstance(_day, tuple):
-                    _day = _day[0]  # Fix binding problem.
                 meals_data[str(_day)] = list(map(lambda meal: meal.to_dict(), _meals))
 
         return {
@@ -228,9 +236,15 @@ class BaseRestaurant:
             'url': self._URL,
             'accepts_cards': self.accept_cards,
             'last_scrape': str(self.last_scraping),
+            'address': self.address,
             'meals': meals_data
         }
 
+    def reset_meals(self) -> None:
+        """Replace meals by empty ones (for every day)."""
+
+        self.MEALS = dict(map(lambda day: (day, []), WeekDays.all_days()))
+
     def add_meal(self, day: str, name: str, price: float, description: Optional[str] = None,
                  alergens: Optional[List[str]] = None, is_vegan: bool = False,
                  is_gluten_free: bool = False, is_soup: bool = False) -> bool:
@@ -240,26 +254,88 @@ class BaseRestaurant:
         logging.debug(f'Successfully added meal for day {day} with data: {self.MEALS[day][-1]}.')
         return True
 
-    def load_meals(self, force_scrape: bool = False) -> None:
-        """Load meals from redis if possible."""
+    def load_meals(self, force_scrape: bool = False, day: Optional[str] = None) -> None:
+        """Load meals from redis, only the selected day is loaded when `day` is set.
+
+        Meals are scraped only when `force_scrape` is set, days which are not stored (yet) are left empty,
+        so serving of requests never starts scraping (it is done by scraping workers).
+        """
+
+        if force_scrape:
+            lock: LeaseLock = self.scraping_lock()
+            if lock.acquire() is None:
+                # Somebody else is already scraping, so we would just wait for its results
+                logging.debug(f'Restaurant {self.name} is already being scraped, skipping scraping in load request.')
+                return
+
+            try:
+                # During scraping we should already fill MEALS atribute
+                logging.debug(f'Starting scraping for restaurant {self.name} in load request.')
+                self.fencing_token = lock.token
+                if ResilientScrape(self).run():
+                    self.save_meals()
+                else:
+                    logging.warning(f'Scraping for restaurant {self.name} in load request failed, nothing was saved.')
+            finally:
+                lock.release()
+            return
+
+        raw_days: Dict[str, str] = load_days(self.redis_client, self._hash, [str(day)] if day else None)
+        if not raw_days:
+            logging.debug(f'Meals for restaurant {self.name} are not stored, nothing to load.')
+            return
 
-        redis_key: str = f'{self._hash}-meals'
-        raw_meals: str = self.redis_client.get(redis_key)
+        logging.debug(f'Starting meals deserialization (loading) for restaurant {self.name}.')
+        self.MEALS.update(RestaurantMeal.deserialize_meals(raw_days, self._load_dishes))
 
-        if force_scrape or not raw_meals:
-            # During scraping we should already fill MEALS atribute
-            logging.debug(f'Starting scraping for restaurant {self.name} in load request.')
-            self._init_scrapers()  # Try to init scraper if is not already initialised
-            self.scrape()
-            return self.save_meals()
+    def _load_dishes(self, dish_ids: List[str]) -> Dict[str, dict]:
+        """Details of dishes referenced by stored meals."""
 
-        logging.debug(f'Starting meals deserialization (loading) for restaurant {self.name}.')
-        self.MEALS = RestaurantMeal.deserialize_meals(raw_meals)
+        return dish_index.get_many(self.redis_client, dish_ids)
+
+    def restore_snapshot(self, snapshot: dict, dishes: Optional[Dict[str, dict]] = None) -> None:
+        """Fill meals and last scraping from the snapshot loaded by `storage.load_snapshots`.
 
-    def save_meals(self) -> None:
-        """Save meals to redis if possible."""
+        Details of referenced dishes are taken from `dishes` when they were already loaded (for more snapshots).
+        """
 
-        redis_key: str = f'{self._hash}-meals'
+        load_dishes = self._load_dishes if dishes is None else lambda dish_ids: dishes
+        self.MEALS.update(RestaurantMeal.deserialize_meals(snapshot['days'], load_dishes))
+        # Timestamp is already known (even if restaurant was never scraped), so it is not fetched again
+        self._last_scraping = datetime.fromtimestamp(snapshot['last_scraping'] or 0)
+
+    def save_meals(self) -> Dict[str, int]:
+        """Save scraped meals to redis if possible, only days which changed since the last save are rewritten
+        and appended to the menu archive. Time of the scraping is stored too and announced (with changed days)
+        to subscribers of menu updates.
+
+        Returns mapping of changed days to their new versions.
+        """
+
+        try:
+            # Variants of the same dish are stored only once and referenced by meals
+            new_dishes: int = dish_index.normalize_meals(self.redis_client, self.MEALS)
+            logging.debug(f'Meals for restaurant {self.name} were normalized, {new_dishes} new dishes.')
+        except Exception as exc:
+            # Meals without dish are stored with all details
+            logging.error(f'Normalization of meals for restaurant {self.name} failed with exception: {str(exc)}.')
 
         logging.debug(f'Starting meals serialization (saving) for restaurant {self.name}.')
-        self.redis_client.set(redis_key, RestaurantMeal.serialize_meals(self.MEALS))
+        serialized_days: Dict[str, str] = RestaurantMeal.serialize_meals(self.MEALS)
+        changed_days: Dict[str, int] = save_days(self.redis_client, self._hash, serialized_days, self.fencing_token)
+
+        logging.debug(f'Meals for restaurant {self.name} changed in days: {list(changed_days)}.')
+        self.last_scraping = datetime.now()
+        # Announced even if no day changed, cached data contain the time of the last scraping
+        publish_menu_update(self.redis_client, self._hash, self.name, changed_days, self.last_scraping.timestamp())
+
+        if changed_days:
+            try:
+                menu_archive.archive_days(self._hash, {day: [meal.to_dict() for meal in self.MEALS.get(day, [])]
+                                                       for day in changed_days}, changed_days)
+            except Exception as exc:
+                # Archive is not critical, current menus are already saved
+                logging.error(f'Archiving meals for restaurant {self.name} failed with exception: {str(exc)}.')
+
+        return changed_days
+
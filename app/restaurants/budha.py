@@ -2,8 +2,6 @@ from __future__ import annotations
 import logging
 import re
 
-from selenium.webdriver.common.by import By
-
 from utility import WeekDays
 from .base_restaurant import BaseRestaurant
 from typing import TYPE_CHECKING
@@ -81,6 +79,8 @@ class BudhaRestaurant(BaseRestaurant):
         return True
 
     def scrape(self) -> bool:
+        from selenium.webdriver.common.by import By  # Imported lazily, only scrapers need selenium
+
         root_element: WebElement = self.web_driver.find_element(by=By.XPATH, value='/html/body/div/div[1]/div[3]/div')
         menus_elements: List[WebElement] = root_element.find_elements(by=By.CLASS_NAME, value='textmenu')
 
@@ -0,0 +1,265 @@
+"""
+Dishes
+======
+
+Module containing normalization and deduplication of scraped meals.
+
+Text of every meal is cleaned (whitespace, bullets) and folded (diacritics, case, punctuation) and the meal is
+matched to an already known dish with the same attributes (soup, vegan, gluten free, alergens): exactly by
+the folded text or fuzzily by character n-grams (MinHash LSH index). Fuzzy matches are accepted only when
+the texts have the same words which differ at most in their endings (inflection, typos), so different dishes
+sharing side dishes are never merged. Dishes are stored once in Redis under stable IDs and daily menus only
+reference them (with the price and the cleaned text of the variant, which is served as it was scraped).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import unicodedata
+import zlib
+
+from collections import defaultdict
+from redis import Redis
+from storage import _decode
+from config import (
+    DISH_MINHASH_BANDS, DISH_MINHASH_PERMUTATIONS, DISH_NGRAM_SIZE, DISH_SIMILARITY_THRESHOLD, DISH_WORD_ENDING
+)
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Dict, Iterable, List, Optional, Set, Tuple
+    from .models import RestaurantMeal
+
+
+# Redis hash containing details of dishes (JSON) by their IDs
+DISHES_KEY: str = 'dishes'
+# Redis hash containing IDs of dishes by all their seen variants (block and folded text)
+DISH_ALIASES_KEY: str = 'dish-aliases'
+
+# Fields describing the dish (everything except the price)
+DISH_FIELDS: List[str] = ['name', 'description', 'alergens', 'is_vegan', 'is_gluten_free', 'is_soup']
+
+_STRIPPED_CHARACTERS: str = ' *-•–—·,;:'
+_NON_WORD_PATTERN: re.Pattern = re.compile(r'[\W_]+')
+_MERSENNE_PRIME: int = (1 << 61) - 1
+
+
+def clean_text(text: Optional[str]) -> Optional[str]:
+    """Canonical whitespace of scraped text without leading bullets and surrounding punctuation."""
+
+    if text is None:
+        return None
+
+    return ' '.join(str(text).split()).strip(_STRIPPED_CHARACTERS) or None
+
+
+def fold_text(text: Optional[str]) -> str:
+    """Matching form of text: without diacritics and punctuation, case folded."""
+
+    decomposed: str = unicodedata.normalize('NFKD', text or '')
+    stripped: str = ''.join(character for character in decomposed if not unicodedata.combining(character))
+    return ' '.join(_NON_WORD_PATTERN.sub(' ', stripped.casefold()).split())
+
+
+def ngrams(text: str, size: int = DISH_NGRAM_SIZE) -> Set[str]:
+    """Character n-grams of the (folded) text, words are padded by spaces."""
+
+    padded: str = f' {text} '
+    return {padded[index:index + size] for index in range(max(1, len(padded) - size + 1))}
+
+
+def words_match(text: str, other_text: str, ending: int = DISH_WORD_ENDING) -> bool:
+    """Whether (folded) texts have the same words in the same order, words can differ only in their endings."""
+
+    words: List[str] = text.split()
+    other_words: List[str] = other_text.split()
+    if len(words) != len(other_words):
+        return False
+
+    for word, other_word in zip(words, other_words):
+        if word == other_word:
+            continue
+
+        prefix: int = len(os.path.commonprefix([word, other_word]))
+        # Short words (prepositions, amounts...) have to be the same
+        if prefix < max(len(word), len(other_word)) - ending or prefix < 3:
+            return False
+
+    return True
+
+
+def _block(details: dict) -> str:
+    """Attributes which have to match exactly for meals to be the same dish."""
+
+    alergens: List[str] = sorted(str(alergen) for alergen in details.get('alergens') or [])
+    return json.dumps([bool(details.get('is_soup')), bool(details.get('is_vegan')),
+                       bool(details.get('is_gluten_free')), alergens])
+
+
+def _text(details: dict) -> str:
+    return fold_text(f'{details.get("name") or ""} {details.get("description") or ""}')
+
+
+class MinHash:
+    """MinHash signatures of n-gram sets (hash functions are seeded, so signatures are stable across processes)."""
+
+    def __init__(self, permutations: int = DISH_MINHASH_PERMUTATIONS, seed: int = 42) -> None:
+        generator: random.Random = random.Random(seed)
+        self.coefficients: List[Tuple[int, int]] = [
+            (generator.randrange(1, _MERSENNE_PRIME), generator.randrange(0, _MERSENNE_PRIME))
+            for _ in range(permutations)
+        ]
+
+    def signature(self, grams: Iterable[str]) -> Tuple[int, ...]:
+        hashes: List[int] = [zlib.crc32(gram.encode('utf-8')) for gram in grams]
+        return tuple(min((a * value + b) % _MERSENNE_PRIME for value in hashes) for a, b in self.coefficients)
+
+
+class DishIndex:
+    """In-process index of known dishes (details, aliases and LSH buckets), synchronized with Redis.
+
+    Web processes use it only as a cache of dish details (dishes never change once stored), the LSH index
+    is built lazily by the first matching (scraping side).
+    """
+
+    def __init__(self, threshold: float = DISH_SIMILARITY_THRESHOLD, permutations: int = DISH_MINHASH_PERMUTATIONS,
+                 bands: int = DISH_MINHASH_BANDS) -> None:
+        self.threshold: float = threshold
+        self.minhash: MinHash = MinHash(permutations)
+        self.rows: int = permutations // bands
+
+        self._dishes: Dict[str, dict] = {}
+        self._aliases: Dict[str, str] = {}
+        self._texts: Dict[str, str] = {}
+        self._grams: Dict[str, Set[str]] = {}
+        # (block, band, band of the signature) -> IDs of dishes
+        self._buckets: Dict[tuple, List[str]] = defaultdict(list)
+        self._lock: threading.RLock = threading.RLock()
+
+    @staticmethod
+    def dish_id(block: str, text: str) -> str:
+        """Stable ID of the dish derived from its first seen variant."""
+
+        return hashlib.sha1(f'{block}|{text}'.encode('utf-8')).hexdigest()[:16]
+
+    def _bands(self, block: str, grams: Set[str]) -> List[tuple]:
+        signature: Tuple[int, ...] = self.minhash.signature(grams)
+        return [(block, band, signature[band * self.rows:(band + 1) * self.rows])
+                for band in range(len(signature) // self.rows)]
+
+    def _index(self, dish_id: str, details: dict) -> None:
+        """Add the dish to LSH buckets (lock has to be held)."""
+
+        if dish_id in self._grams:
+            return
+
+        block: str = _block(details)
+        self._texts[dish_id] = _text(details)
+        self._grams[dish_id] = ngrams(self._texts[dish_id])
+        for bucket in self._bands(block, self._grams[dish_id]):
+            self._buckets[bucket].append(dish_id)
+
+    def get_many(self, client: Redis, dish_ids: Iterable[str]) -> Dict[str, dict]:
+        """Details of dishes by their IDs (unknown IDs are left out)."""
+
+        dish_ids = list(dict.fromkeys(dish_ids))
+        missing: List[str] = [dish_id for dish_id in dish_ids if dish_id not in self._dishes]
+        if missing:
+            for dish_id, raw_details in zip(missing, client.hmget(DISHES_KEY, missing)):
+                if raw_details is not None:
+                    self._dishes[dish_id] = json.loads(raw_details)
+
+        return {dish_id: self._dishes[dish_id] for dish_id in dish_ids if dish_id in self._dishes}
+
+    def refresh(self, client: Redis) -> None:
+        """Load dishes and aliases stored by other workers and index all dishes."""
+
+        with self._lock:
+            # Aliases are loaded first, dishes are always stored together with (before) their aliases
+            if client.hlen(DISH_ALIASES_KEY) != len(self._aliases):
+                self._aliases = {_decode(alias): _decode(dish_id)
+                                 for alias, dish_id in client.hgetall(DISH_ALIASES_KEY).items()}
+
+            if client.hlen(DISHES_KEY) != len(self._dishes):
+                for dish_id, raw_details in client.hgetall(DISHES_KEY).items():
+                    self._dishes.setdefault(_decode(dish_id), json.loads(raw_details))
+
+            for dish_id, details in self._dishes.items():
+                self._index(dish_id, details)
+
+    def match(self, details: dict) -> Optional[str]:
+        """ID of the known dish with the same block and the most similar text over the threshold (with the same
+        words, see `words_match`).
+        """
+
+        block: str = _block(details)
+        text: str = _text(details)
+
+        with self._lock:
+            dish_id: Optional[str] = self._aliases.get(f'{block}|{text}')
+            if dish_id is not None:
+                return dish_id
+
+            grams: Set[str] = ngrams(text)
+            candidates: Set[str] = {candidate for bucket in self._bands(block, grams)
+                                    for candidate in self._buckets.get(bucket, [])}
+
+            best_id, best_similarity = None, self.threshold
+            for candidate in candidates:
+                candidate_grams: Set[str] = self._grams[candidate]
+                similarity: float = len(grams & candidate_grams) / len(grams | candidate_grams)
+                if similarity >= best_similarity and words_match(text, self._texts[candidate]):
+                    best_id, best_similarity = candidate, similarity
+
+            return best_id
+
+    def normalize_meals(self, client: Redis, meals: Dict[str, List[RestaurantMeal]]) -> int:
+        """Clean text of meals and assign them IDs of matching dishes, new dishes and aliases are stored.
+        Returns amount of new dishes.
+
+        Meals keep their own (cleaned) text, details of the dish are only the ones of its first seen variant.
+        """
+
+        self.refresh(client)
+
+        new_dishes: Dict[str, str] = {}
+        new_aliases: Dict[str, str] = {}
+
+        with self._lock:
+            for meal in [meal for day_meals in meals.values() for meal in day_meals]:
+                meal.name = clean_text(meal.name) or meal.name
+                meal.description = clean_text(meal.description)
+                details: dict = {field: getattr(meal, field) for field in DISH_FIELDS}
+
+                alias: str = f'{_block(details)}|{_text(details)}'
+                dish_id: Optional[str] = self.match(details)
+                if dish_id is None:
+                    dish_id = self.dish_id(_block(details), _text(details))
+                    self._dishes[dish_id] = details
+                    self._index(dish_id, details)
+                    new_dishes[dish_id] = json.dumps(details)
+
+                if alias not in self._aliases:
+                    self._aliases[alias] = dish_id
+                    new_aliases[alias] = dish_id
+
+                meal.dish_id = dish_id
+
+        if new_dishes or new_aliases:
+            pipeline = client.pipeline()
+            for dish_id, raw_details in new_dishes.items():
+                pipeline.hsetnx(DISHES_KEY, dish_id, raw_details)  # The first stored variant wins
+            if new_aliases:
+                pipeline.hset(DISH_ALIASES_KEY, mapping=new_aliases)
+            pipeline.execute()
+
+        return len(new_dishes)
+
+
+# Global dish index instance (one per process)
+dish_index: DishIndex = DishIndex()
@@ -0,0 +1,124 @@
+"""
+Models
+======
+
+Lightweight read-only models shared by the API and scrapers (no scraping dependencies are imported here).
+"""
+
+from __future__ import annotations
+
+import json
+
+from flask_restful import fields
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Callable, List, Optional, Dict
+
+
+class RestaurantMeal:
+
+    MEAL_FIELDS: dict = {
+        'name': fields.String, 'price': fields.Float, 'description': fields.String,
+        'alergens': fields.List(fields.String), 'is_vegan': fields.Boolean,
+        'is_gluten_free': fields.Boolean, 'is_soup': fields.Boolean, 'dish_id': fields.String,
+    }
+
+    # NOTE: Float is not the best type for curency butt here it should do the job
+    def __init__(self, name: str, price: float, description: Optional[str], alergens: Optional[List[str]],
+                 is_vegan: bool = False, is_gluten_free: bool = False, is_soup: bool = False,
+                 dish_id: Optional[str] = None) -> None:
+        self.name: str = name
+        self.price: float = price
+        self.description: str = description
+        self.alergens: List['str'] = alergens
+        self.is_vegan: bool = is_vegan
+        self.is_gluten_free: bool = is_gluten_free
+        self.is_soup: bool = is_soup
+        self.dish_id: Optional[str] = dish_id  # Assigned by normalization (see `dishes.py`)
+
+    def to_dict(self) -> dict:
+        """Returns meal as dictonary."""
+
+        return {
+            'name': self.name,
+            'price': self.price,
+            'description': self.description,
+            'alergens': self.alergens,
+            'is_vegan': self.is_vegan,
+            'is_gluten_free': self.is_gluten_free,
+            'is_soup': self.is_soup,
+            'dish_id': self.dish_id,
+        }
+
+    @staticmethod
+    def from_dict(raw_dict: dict) -> RestaurantMeal:
+        """Deserialize meal from the dict."""
+
+        return RestaurantMeal(raw_dict.get('name', 'ERROR'), raw_dict.get('price', 0.0), raw_dict.get('description', ''),
+                              raw_dict.get('alergens', []), raw_dict.get('is_vegan', False),
+                              raw_dict.get('is_gluten_free', False), raw_dict.get('is_soup', False),
+                              raw_dict.get('dish_id'))
+
+    def to_reference(self) -> dict:
+        """Returns meal as reference to its dish (with the price and text of the variant), other details are stored
+        only once for the dish.
+        """
+
+        if self.dish_id is None:
+            return self.to_dict()
+
+        return {'dish_id': self.dish_id, 'price': self.price, 'name': self.name, 'description': self.description}
+
+    @staticmethod
+    def serialize_meals(data: Dict[str, List[RestaurantMeal]]) -> Dict[str, str]:
+        """Serialize meals to the mapping of day and its JSON representation."""
+
+        data_copy: Dict[str, str] = {}
+
+        for day, meals in data.items():
+            data_copy[str(day)] = json.dumps(list(map(lambda meal: meal.to_reference(), meals)))
+
+        return data_copy
+
+    @staticmethod
+    def decode_days(raw_days: Dict[str, str]) -> Dict[str, List[dict]]:
+        """Decode the mapping of day and JSON representation of its meals."""
+
+        return {day: json.loads(raw_meals) for day, raw_meals in raw_days.items()}
+
+    @staticmethod
+    def dish_references(days: Dict[str, List[dict]]) -> List[str]:
+        """IDs of dishes whose details have to be loaded for decoded meals (stored as references)."""
+
+        return [meal_raw['dish_id'] for meals_raw in days.values() for meal_raw in meals_raw
+                if meal_raw.get('dish_id') and 'alergens' not in meal_raw]
+
+    @staticmethod
+    def deserialize_meals(raw_days: Dict[str, str],
+                          load_dishes: Optional[Callable[[List[str]], Dict[str, dict]]] = None
+                          ) -> Dict[str, List[RestaurantMeal]]:
+        """Deserialize meals from the mapping of day and its JSON representation (or already decoded meals,
+        see `decode_days`).
+
+        Details of referenced dishes are retrieved by `load_dishes` (mapping of dish ID and its details), text stored
+        with the meal takes precedence.
+        """
+
+        days: Dict[str, List[dict]] = {
+            day: json.loads(raw_meals) if isinstance(raw_meals, (str, bytes)) else raw_meals
+            for day, raw_meals in raw_days.items()
+        }
+
+        references: List[str] = RestaurantMeal.dish_references(days)
+        dishes: Dict[str, dict] = load_dishes(references) if references and load_dishes else {}
+
+        return_data: Dict[str, List[RestaurantMeal]] = {}
+
+        for day, meals_raw in days.items():
+            meals = list(map(lambda meal_raw: RestaurantMeal.from_dict(
+                dict(dishes.get(meal_raw.get('dish_id'), {}), **meal_raw)
+            ), meals_raw))
+            return_data[day] = meals
+
+        return return_data
@@ -0,0 +1,183 @@
+"""
+Resilience
+==========
+
+Module containing resilience layer around restaurant scraping: bounded retries with jittered backoff,
+per-restaurant circuit breaker and per-domain rate limiting (token bucket), both stored in Redis.
+"""
+
+from __future__ import annotations
+
+import logging
+import random
+import time
+
+from urllib.parse import urlparse
+from redis import Redis
+from storage import get_redis_client
+from config import (
+    CIRCUIT_COOLDOWN, CIRCUIT_FAILURE_THRESHOLD, RATE_LIMIT_BURST, RATE_LIMIT_MAX_WAIT, RATE_LIMIT_PER_MINUTE,
+    SCRAPE_RETRIES, SCRAPE_RETRY_BASE_DELAY, SCRAPE_RETRY_MAX_DELAY
+)
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Iterator, Optional
+    from .base_restaurant import BaseRestaurant
+
+
+# Refill the bucket and take a token, returns seconds to wait (as string, Lua would truncate float)
+_TAKE_TOKEN_SCRIPT: str = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+local updated = tonumber(redis.call('HGET', KEYS[1], 'updated'))
+if tokens == nil then
+    tokens = capacity
+    updated = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class CircuitOpenError(Exception):
+    """Raised when scraping is skipped because the restaurant is known to be broken."""
+
+
+class RateLimitExceeded(Exception):
+    """Raised when the domain is busy for longer than the allowed wait."""
+
+
+class RetryPolicy:
+    """Bounded retries with exponential backoff and full jitter."""
+
+    def __init__(self, attempts: int = SCRAPE_RETRIES, base_delay: float = SCRAPE_RETRY_BASE_DELAY,
+                 max_delay: float = SCRAPE_RETRY_MAX_DELAY) -> None:
+        self.attempts: int = attempts
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+
+    def delays(self) -> Iterator[float]:
+        """Delays before every attempt (the first attempt is not delayed)."""
+
+        yield 0.0
+        for attempt in range(1, self.attempts):
+            yield random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Per-restaurant circuit breaker, opened after several failures in a row until the cooldown expires.
+
+    After the cooldown a single scraping is allowed again (half-open), its failure opens the circuit again.
+    """
+
+    def __init__(self, client: Redis, restaurant_id: int, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 cooldown: int = CIRCUIT_COOLDOWN) -> None:
+        self.client: Redis = client
+        self.key: str = f'circuit-{restaurant_id}'
+        self.failure_threshold: int = failure_threshold
+        self.cooldown: int = cooldown
+
+    @property
+    def opened_until(self) -> float:
+        """Timestamp until the circuit is opened (0 if it is closed)."""
+
+        return float(self.client.hget(self.key, 'opened_until') or 0)
+
+    def allow(self) -> bool:
+        return self.opened_until <= time.time()
+
+    def record_success(self) -> None:
+        self.client.delete(self.key)
+
+    def record_failure(self) -> None:
+        failures: int = self.client.hincrby(self.key, 'failures', 1)
+        if failures >= self.failure_threshold:
+            self.client.hset(self.key, 'opened_until', time.time() + self.cooldown)
+
+
+class TokenBucket:
+    """Rate limiter shared by all workers, every page load takes one token."""
+
+    def __init__(self, client: Redis, name: str, per_minute: float = RATE_LIMIT_PER_MINUTE,
+                 burst: int = RATE_LIMIT_BURST) -> None:
+        self.client: Redis = client
+        self.key: str = f'rate-limit-{name}'
+        self.rate: float = per_minute / 60
+        self.capacity: int = burst
+
+    def try_take(self) -> float:
+        """Try to take a token, returns 0 on success or seconds to wait for the next token."""
+
+        return float(self.client.eval(_TAKE_TOKEN_SCRIPT, 1, self.key, self.rate, self.capacity, time.time()))
+
+    def take(self, max_wait: float = RATE_LIMIT_MAX_WAIT) -> float:
+        """Take a token (waiting if necessary), returns waited seconds. Raises `RateLimitExceeded`."""
+
+        waited: float = 0.0
+        while True:
+            wait: float = self.try_take()
+            if wait <= 0:
+                return waited
+
+            if waited + wait > max_wait:
+                raise RateLimitExceeded(f'Rate limit of {self.key} exceeded, next token in {wait:.1f}s.')
+
+            time.sleep(wait)
+            waited += wait
+
+
+class ResilientScrape:
+    """Scrape the restaurant with retries, behind its circuit breaker and rate limit of its domain."""
+
+    def __init__(self, restaurant: BaseRestaurant, policy: Optional[RetryPolicy] = None) -> None:
+        self.restaurant: BaseRestaurant = restaurant
+        self.policy: RetryPolicy = policy or RetryPolicy()
+        self.breaker: CircuitBreaker = CircuitBreaker(get_redis_client(), restaurant.restaurant_id())
+        self.bucket: TokenBucket = TokenBucket(get_redis_client(), urlparse(restaurant._URL).netloc)
+
+    def run(self) -> bool:
+        """Returns result of the last attempt, raises `CircuitOpenError` when the restaurant is skipped
+        and the last exception when all attempts failed.
+        """
+
+        from .supervisor import ScrapeSupervisor  # Scraping side only
+
+        if not self.breaker.allow():
+            raise CircuitOpenError(f'Restaurant {self.restaurant.name} is skipped until {self.breaker.opened_until}.')
+
+        last_exception: Optional[Exception] = None
+        for attempt, delay in enumerate(self.policy.delays(), start=1):
+            time.sleep(delay)
+
+            try:
+                self.bucket.take()
+                self.restaurant.reset_meals()  # Drop meals of the previous attempt
+
+                if ScrapeSupervisor(self.restaurant).run():
+                    self.breaker.record_success()
+                    return True
+
+                # Page was loaded but not parsed, another attempt would most likely end the same way
+                logging.warning(f'Scraping for restaurant {self.restaurant.name} was not successful.')
+                self.breaker.record_failure()
+                return False
+            except RateLimitExceeded:
+                raise  # Domain is busy, retrying would just wait again
+            except Exception as exc:
+                last_exception = exc
+                logging.warning(f'Attempt {attempt}/{self.policy.attempts} of scraping for restaurant '
+                                f'{self.restaurant.name} failed with exception: {str(exc)}.')
+
+        self.breaker.record_failure()
+        raise last_exception
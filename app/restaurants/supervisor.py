@@ -0,0 +1,216 @@
+"""
+Supervisor
+==========
+
+Module running restaurant scraping under resource supervision.
+
+Every scraping gets its own browser which is always quit at the end, a watchdog thread kills the browser
+when wall-clock or memory limit is exceeded, and browser processes left behind are reaped.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+
+import psutil
+
+from storage import get_redis_client
+from config import SCRAPE_MAX_RSS, SCRAPE_REPORTS_LIMIT, SCRAPE_TIMEOUT, SCRAPE_WATCHDOG_INTERVAL
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import List, Optional, Set
+    from .base_restaurant import BaseRestaurant
+
+
+# Names of processes spawned by selenium
+BROWSER_PROCESS_NAMES: Set[str] = {'chrome', 'chromium', 'chromium-browser', 'chromedriver'}
+
+# Redis key containing latest resource usage reports
+SCRAPE_REPORTS_KEY: str = 'scraping-reports'
+
+# PIDs of drivers which are currently used by some supervised scraping in this process
+_ACTIVE_DRIVERS: Set[int] = set()
+
+
+class ScrapeLimitExceeded(Exception):
+    """Raised when scraping was killed by the watchdog."""
+
+
+def _process_tree(pid: int) -> List[psutil.Process]:
+    """Return process with all its descendants (empty if the process does not exist anymore)."""
+
+    try:
+        process: psutil.Process = psutil.Process(pid)
+        return [process] + process.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return []
+
+
+def _tree_rss(processes: List[psutil.Process]) -> int:
+    """Sum resident memory of all processes (processes which already ended are ignored)."""
+
+    rss: int = 0
+    for process in processes:
+        try:
+            rss += process.memory_info().rss
+        except psutil.NoSuchProcess:
+            continue
+
+    return rss
+
+
+def _kill_processes(processes: List[psutil.Process]) -> int:
+    """Kill all processes and wait for them (so they do not stay as zombies), returns amount of killed processes."""
+
+    killed: List[psutil.Process] = []
+    for process in processes:
+        try:
+            process.kill()
+            killed.append(process)
+        except psutil.NoSuchProcess:
+            continue
+
+    psutil.wait_procs(killed, timeout=5)
+    return len(killed)
+
+
+def reap_orphaned_browsers() -> int:
+    """Kill browser processes spawned by this process (or reparented to init) which are not used by any scraping.
+
+    Returns amount of reaped processes.
+    """
+
+    protected: Set[int] = set()
+    for driver_pid in list(_ACTIVE_DRIVERS):
+        protected.update(process.pid for process in _process_tree(driver_pid))
+
+    orphans: List[psutil.Process] = []
+    for process in psutil.process_iter(['name', 'ppid']):
+        if process.info['name'] not in BROWSER_PROCESS_NAMES or process.pid in protected:
+            continue
+
+        if process.info['ppid'] in (1, os.getpid()):
+            orphans.append(process)
+
+    # Descendants of the orphans (renderers, GPU process...) are killed as well
+    for orphan in list(orphans):
+        orphans.extend(process for process in _process_tree(orphan.pid)[1:] if process.pid not in protected)
+
+    reaped: int = _kill_processes(orphans)
+    if reaped:
+        logging.warning(f'Reaped {reaped} orphaned browser processes.')
+
+    return reaped
+
+
+class ScrapeSupervisor:
+    """Run scraping of a single restaurant under wall-clock and memory limits."""
+
+    def __init__(self, restaurant: BaseRestaurant, timeout: int = SCRAPE_TIMEOUT, max_rss: int = SCRAPE_MAX_RSS) -> None:
+        self.restaurant: BaseRestaurant = restaurant
+        self.timeout: int = timeout
+        self.max_rss: int = max_rss
+
+        self._finished: threading.Event = threading.Event()
+        self._killed_reason: Optional[str] = None
+        self._peak_rss: int = 0
+        self._start_time: float = 0
+
+    def _driver_pid(self) -> Optional[int]:
+        """PID of chromedriver of the supervised restaurant (`None` if browser is not running)."""
+
+        try:
+            return self.restaurant.web_driver.service.process.pid
+        except AttributeError:
+            return None
+
+    def _watch(self) -> None:
+        """Watchdog loop, kills the browser when some limit is exceeded."""
+
+        while not self._finished.wait(SCRAPE_WATCHDOG_INTERVAL):
+            driver_pid: Optional[int] = self._driver_pid()
+            processes: List[psutil.Process] = _process_tree(driver_pid) if driver_pid else []
+
+            rss: int = _tree_rss(processes)
+            self._peak_rss = max(self._peak_rss, rss)
+
+            if time.time() - self._start_time > self.timeout:
+                self._killed_reason = f'wall-clock limit {self.timeout}s exceeded'
+            elif rss > self.max_rss:
+                self._killed_reason = f'memory limit {self.max_rss // (1024 * 1024)}MiB exceeded'
+            else:
+                continue
+
+            if not processes:
+                continue  # Browser is not started yet, it will be killed as soon as it appears
+
+            # Killing the browser makes the pending selenium call fail in the scraping thread
+            logging.error(f'Killing scraping of restaurant {self.restaurant.name}: {self._killed_reason}.')
+            _kill_processes(processes)
+            return
+
+    def _report(self, success: bool, cpu_time: float) -> dict:
+        """Create resource usage report of the finished scraping and store it to Redis."""
+
+        report: dict = {
+            'restaurant': self.restaurant.name,
+            'success': success,
+            'duration': round(time.time() - self._start_time, 3),
+            'worker_cpu_time': round(cpu_time, 3),
+            'peak_browser_rss': self._peak_rss,
+            'worker_rss': psutil.Process().memory_info().rss,
+            'killed_reason': self._killed_reason,
+            'finished_at': time.time(),
+        }
+        logging.info(f'Resource usage of scraping for restaurant {self.restaurant.name}: {report}.')
+
+        try:
+            pipeline = get_redis_client().pipeline()
+            pipeline.lpush(SCRAPE_REPORTS_KEY, json.dumps(report))
+            pipeline.ltrim(SCRAPE_REPORTS_KEY, 0, SCRAPE_REPORTS_LIMIT - 1)
+            pipeline.execute()
+        except Exception as exc:
+            logging.error(f'Was not able to store scraping report: {str(exc)}.')
+
+        return report
+
+    def run(self) -> bool:
+        """Initialise browser, scrape and always quit the browser, returns result of the scraping.
+
+        Raises `ScrapeLimitExceeded` when scraping was killed by the watchdog.
+        """
+
+        self._start_time = time.time()
+        start_cpu: float = time.process_time()
+        success: bool = False
+
+        watchdog: threading.Thread = threading.Thread(target=self._watch, name='scrape-watchdog', daemon=True)
+        watchdog.start()
+
+        try:
+            self.restaurant._init_scrapers()
+            if self._driver_pid():
+                _ACTIVE_DRIVERS.add(self._driver_pid())
+
+            success = self.restaurant.scrape()
+        except Exception:
+            if self._killed_reason:
+                raise ScrapeLimitExceeded(self._killed_reason)
+            raise
+        finally:
+            self._finished.set()
+            watchdog.join()
+
+            _ACTIVE_DRIVERS.discard(self._driver_pid())
+            self.restaurant.close_scrapers()
+            reap_orphaned_browsers()
+            self._report(success, time.process_time() - start_cpu)
+
+        if self._killed_reason:
+            raise ScrapeLimitExceeded(self._killed_reason)
+        return success
@@ -0,0 +1,202 @@
+"""
+Storage
+=======
+
+Module containing helpers for storing restaurant menus in Redis.
+
+Menus are stored per restaurant per day as fields of a single Redis hash, so a single day can be read
+(or rewritten) without touching the rest of the week. Every day has its own version counter which is
+bumped only when the content of that day changes.
+"""
+
+from __future__ import annotations
+
+import json
+
+from functools import lru_cache
+from redis import Redis
+from redis.exceptions import WatchError
+from config import MENU_UPDATES_CHANNEL, REDIS_PORT, REDIS_SERVICE, VIEW_UPDATES_CHANNEL
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Dict, List, Optional, Union
+
+
+@lru_cache(maxsize=None)
+def get_redis_client() -> Redis:
+    """Return Redis client shared by the whole process (connections are pooled by the client)."""
+
+    return Redis(host=REDIS_SERVICE, port=REDIS_PORT, decode_responses=False)
+
+
+def meals_key(restaurant_id: int) -> str:
+    """Key of the hash containing serialized meals (field per day) of the restaurant."""
+
+    return f'{restaurant_id}-meals-days'
+
+
+def meals_versions_key(restaurant_id: int) -> str:
+    """Key of the hash containing version counters (field per day) of the restaurant meals."""
+
+    return f'{restaurant_id}-meals-versions'
+
+
+def last_scraping_key(restaurant_id: int, restaurant_name: str) -> str:
+    """Key containing timestamp of the last scraping of the restaurant."""
+
+    return f'{restaurant_name.replace(" ", "")}-{restaurant_id}-last_scraping'
+
+
+def meals_fence_key(restaurant_id: int) -> str:
+    """Key containing the highest fencing token which was used to write meals of the restaurant."""
+
+    return f'{restaurant_id}-meals-fence'
+
+
+class StaleFencingTokenError(Exception):
+    """Raised when meals are written by the holder of already expired scraping lock."""
+
+
+def _decode(value: Union[bytes, str]) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def diff_days(previous: Dict[str, str], current: Dict[str, str]) -> List[str]:
+    """Return days whose serialized menu differs from the previous snapshot."""
+
+    return [day for day, raw_meals in current.items() if previous.get(day) != raw_meals]
+
+
+def load_days(client: Redis, restaurant_id: int, days: Optional[List[str]] = None) -> Dict[str, str]:
+    """Load serialized meals of the restaurant, only selected days are fetched if `days` is set.
+
+    Days which are not stored are not included in the result.
+    """
+
+    if days is None:
+        return {_decode(day): _decode(raw) for day, raw in client.hgetall(meals_key(restaurant_id)).items()}
+
+    values: list = client.hmget(meals_key(restaurant_id), days)
+    return {day: _decode(raw) for day, raw in zip(days, values) if raw is not None}
+
+
+def load_versions(client: Redis, restaurant_id: int) -> Dict[str, int]:
+    """Load version counters of all stored days of the restaurant."""
+
+    raw_versions: dict = client.hgetall(meals_versions_key(restaurant_id))
+    return {_decode(day): int(version) for day, version in raw_versions.items()}
+
+
+def load_snapshots(client: Redis, restaurants: Dict[int, str]) -> Dict[int, dict]:
+    """Load stored meals, versions and last scraping timestamp of all restaurants (ID and name) in one round trip.
+
+    Every snapshot contains `days`, `versions` and `last_scraping` (`None` if restaurant was never scraped).
+    """
+
+    pipeline = client.pipeline(transaction=False)
+    for restaurant_id, restaurant_name in restaurants.items():
+        # Versions are read before meals, so meals are never older than their versions
+        pipeline.hgetall(meals_versions_key(restaurant_id))
+        pipeline.hgetall(meals_key(restaurant_id))
+        pipeline.get(last_scraping_key(restaurant_id, restaurant_name))
+    results: list = pipeline.execute()
+
+    snapshots: Dict[int, dict] = {}
+    for position, restaurant_id in enumerate(restaurants):
+        raw_versions, raw_days, raw_timestamp = results[position * 3:position * 3 + 3]
+        snapshots[restaurant_id] = {
+            'days': {_decode(day): _decode(raw) for day, raw in raw_days.items()},
+            'versions': {_decode(day): int(version) for day, version in raw_versions.items()},
+            'last_scraping': float(raw_timestamp) if raw_timestamp else None,
+        }
+
+    return snapshots
+
+
+def save_days(client: Redis, restaurant_id: int, serialized_days: Dict[str, str],
+              fencing_token: Optional[int] = None) -> Dict[str, int]:
+    """Save only days which differ from the stored snapshot and bump their versions.
+
+    If `fencing_token` is set, the write is rejected (`StaleFencingTokenError`) when meals were already
+    written with a newer token. Returns mapping of changed days to their new versions (empty if nothing changed).
+    """
+
+    with client.pipeline() as pipeline:
+        while True:
+            try:
+                # Snapshot and token are watched, so concurrent writer forces us to compute diff again
+                pipeline.watch(meals_key(restaurant_id), meals_fence_key(restaurant_id))
+
+                if fencing_token is not None:
+                    stored_token: Optional[bytes] = pipeline.get(meals_fence_key(restaurant_id))
+                    if stored_token is not None and int(stored_token) > fencing_token:
+                        raise StaleFencingTokenError(f'Token {fencing_token} is older than {int(stored_token)}.')
+
+                changed_days: List[str] = diff_days(load_days(pipeline, restaurant_id), serialized_days)
+                if not changed_days:
+                    return {}
+
+                pipeline.multi()
+                if fencing_token is not None:
+                    pipeline.set(meals_fence_key(restaurant_id), fencing_token)
+                pipeline.hset(meals_key(restaurant_id), mapping={day: serialized_days[day] for day in changed_days})
+                for day in changed_days:
+                    pipeline.hincrby(meals_versions_key(restaurant_id), day, 1)
+
+                # New versions are the last results (in order of `changed_days`)
+                return dict(zip(changed_days, pipeline.execute()[-len(changed_days):]))
+            except WatchError:
+                continue
+
+
+def day_view_key(day: Optional[str], encoding: str = 'identity') -> str:
+    """Key of the materialized view containing serialized data of all restaurants for the day (or whole week),
+    compressed variants are stored next to it under the encoding suffix.
+    """
+
+    key: str = f'view-{day or "all"}'
+    return key if encoding == 'identity' else f'{key}-{encoding}'
+
+
+def save_day_views(client: Redis, views: Dict[Optional[str], Dict[str, bytes]]) -> None:
+    """Replace materialized views of days (`None` is the whole week) in all their encodings and announce it
+    to web workers (on its own channel, clients receive only menu updates).
+    """
+
+    pipeline = client.pipeline()
+    for day, variants in views.items():
+        for encoding, payload in variants.items():
+            pipeline.set(day_view_key(day, encoding), payload)
+    pipeline.publish(VIEW_UPDATES_CHANNEL, json.dumps({'views': [day or 'all' for day in views]}))
+    pipeline.execute()
+
+
+def has_day_views(client: Redis) -> bool:
+    """Whether materialized views were already built."""
+
+    return bool(client.exists(day_view_key(None)))
+
+
+def load_day_view(client: Redis, day: Optional[str], encodings: List[str]) -> Optional[Dict[str, bytes]]:
+    """Load materialized view of the day in stored encodings (`None` if the view was not built yet)."""
+
+    payloads: List[Optional[bytes]] = client.mget([day_view_key(day, encoding) for encoding in encodings])
+    variants: Dict[str, bytes] = {
+        encoding: payload for encoding, payload in zip(encodings, payloads) if payload is not None
+    }
+    return variants if 'identity' in variants else None
+
+
+def publish_menu_update(client: Redis, restaurant_id: int, restaurant_name: str, changed_days: Dict[str, int],
+                        last_scraping: Optional[float] = None) -> None:
+    """Notify all subscribers (web workers) that the restaurant was scraped, `changed_days` are empty
+    if only the time of the last scraping changed.
+    """
+
+    client.publish(MENU_UPDATES_CHANNEL, json.dumps({
+        'restaurant_id': restaurant_id,
+        'restaurant': restaurant_name,
+        'days': changed_days,
+        'last_scraping': last_scraping,
+    }))
@@ -7,17 +7,32 @@ Module containing all available celery tasks Mainly the one used for scraping re
 
 from __future__ import annotations
 
+import json
 import logging
 import os
 import time
-
-from celery import Celery
-from restaurants import RESTAURANTS, RestaurantsFactory
-from config import REDIS_PORT, REDID_IP
-
-
-CELERY_BROKER_URL: str = os.environ.get('CELERY_BROKER_URL', f'redis://{REDIS_PORT}:{REDIS_PORT}'),
-CELERY_RESULT_BACKEND: str = os.environ.get('CELERY_RESULT_BACKEND', f'redis://{REDIS_PORT}:{REDIS_PORT}')
+import traceback
+import uuid
+
+from collections import Counter
+from celery import Celery, chord
+from celery.result import AsyncResult
+from locks import LeaseLock
+from restaurants import FAILED_STATUSES, RESTAURANTS, RESTAURANTS_BY_ID, RestaurantsFactory
+from storage import get_redis_client, has_day_views
+from config import (
+    REDIS_PORT, REDID_IP, SCRAPE_WORKER_MAX_MEMORY, SCRAPE_WORKER_MAX_TASKS, SCRAPING_LOCK_TTL, SCRAPING_QUEUE,
+    SCRAPING_RUN_LOCK_TTL, SCRAPING_RUN_STATS_TTL, SCRAPING_RUNS_LIMIT
+)
+
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from typing import Dict, List, Optional
+    from redis import Redis
+
+
+CELERY_BROKER_URL: str = os.environ.get('CELERY_BROKER_URL', f'redis://{REDID_IP}:{REDIS_PORT}')
+CELERY_RESULT_BACKEND: str = os.environ.get('CELERY_RESULT_BACKEND', f'redis://{REDID_IP}:{REDIS_PORT}')
 TASK_REPEAT_TIME: int = 3600  # 1 hour
 
 
@@ -26,6 +41,16 @@ def _init_celery(_broker: str, _backend: str) -> Celery:
 
     _celery: Celery = Celery('tasks', broker=_broker, backend=_backend)
     _celery.conf.timezone = 'UTC'
+    _celery.conf.task_track_started = True  # Job status can be `STARTED` and not only `PENDING`
+
+    # Scraping tasks are long, so every worker process reserves only one task at a time and the task is
+    # acknowledged after it is done (it is redelivered when the worker dies)
+    _celery.conf.task_routes = {'tasks.scrape_restaurant': {'queue': SCRAPING_QUEUE}}
+    _celery.conf.worker_prefetch_multiplier = 1
+
+    # Recycle worker processes, so memory leaked by scraping (browsers, selenium) can not pile up
+    _celery.conf.worker_max_tasks_per_child = SCRAPE_WORKER_MAX_TASKS
+    _celery.conf.worker_max_memory_per_child = SCRAPE_WORKER_MAX_MEMORY
 
     return _celery
 
@@ -34,6 +59,85 @@ def _init_celery(_broker: str, _backend: str) -> Celery:
 celery: Celery = _init_celery(CELERY_BROKER_URL, CELERY_RESULT_BACKEND)
 
 
+def _scraping_run_lock(owner: Optional[str] = None) -> LeaseLock:
+    """Lock guarding the whole scraping run (only one run can be in progress)."""
+
+    return LeaseLock(get_redis_client(), 'scraping-run', SCRAPING_RUN_LOCK_TTL, owner=owner)
+
+
+def enqueue_scraping(force_scraping: bool = False) -> str:
+    """Enqueue scraping task and return its job ID.
+
+    If some scraping run is already in progress, no task is enqueued and ID of the in-flight job is returned.
+    """
+
+    job_id: str = uuid.uuid4().hex
+    lock: LeaseLock = _scraping_run_lock(owner=job_id)
+
+    while lock.acquire() is None:
+        running_job_id: Optional[str] = lock.holder
+        if running_job_id is not None:
+            logging.info(f'Scraping job {running_job_id} is already in progress, coalescing.')
+            return running_job_id
+
+        # Lock expired in the meantime, try to acquire it again
+
+    # Lock is already held for the job, task will just renew it
+    _record_job(job_id, 'PENDING')
+    try:
+        scrape.apply_async(kwargs={'force_scraping': force_scraping}, task_id=job_id)
+    except Exception:
+        lock.release()  # Job does not exist (e.g. broker is down), requests must not coalesce onto it
+        raise
+
+    return job_id
+
+
+def get_scraping_job(job_id: str) -> Optional[dict]:
+    """Retrieve status of the scraping job (the job is done once statistics of its run are recorded).
+
+    Status is `PENDING`, `STARTED`, `SUCCESS`, `FAILURE` or `SKIPPED` (other run was already in progress,
+    its ID is in `coalesced_with`). Returns `None` if the job is unknown.
+    """
+
+    client: Redis = get_redis_client()
+    raw_stats: Optional[bytes] = client.get(_run_stats_key(job_id))
+    if raw_stats is not None:
+        stats: dict = json.loads(raw_stats)
+        return {'job_id': job_id, 'status': 'SUCCESS', 'failed_scrapers': stats['failed'], 'coalesced_with': None}
+
+    raw_job: Optional[bytes] = client.get(_job_key(job_id))
+    if raw_job is not None:
+        return dict(json.loads(raw_job), job_id=job_id, failed_scrapers=None)
+
+    # Job was not recorded (e.g. its record expired), only the result backend can know it
+    result: AsyncResult = AsyncResult(job_id, app=celery)
+    if result.state == 'PENDING':
+        return None  # Celery reports unknown tasks as pending
+
+    status: str = result.state
+    if result.successful():
+        # Dispatching task is done, but restaurants are still being scraped (or other run was in progress)
+        status = 'STARTED' if result.result is not None else 'SKIPPED'
+
+    return {'job_id': job_id, 'status': status, 'failed_scrapers': None, 'coalesced_with': None}
+
+
+def _run_stats_key(run_id: str) -> str:
+    return f'scraping-run-{run_id}'
+
+
+def _job_key(job_id: str) -> str:
+    return f'scraping-job-{job_id}'
+
+
+def _record_job(job_id: str, status: str, coalesced_with: Optional[str] = None) -> None:
+    """Record status of the job until statistics of its run are recorded (see `get_scraping_job`)."""
+
+    get_redis_client().set(_job_key(job_id), json.dumps({'status': status, 'coalesced_with': coalesced_with}),
+                           ex=SCRAPING_RUN_STATS_TTL)
+
+
 @celery.on_after_configure.connect
 def setup_periodic_tasks(sender, **kwargs) -> None:
     """Register periodic tasks."""
@@ -41,20 +145,97 @@ def setup_periodic_tasks(sender, **kwargs) -> None:
     sender.add_periodic_task(float(TASK_REPEAT_TIME), scrape, name='periodic_scraping')
 
 
-@celery.task(name='tasks.scraping', soft_time_limit=1800)
-def scrape(force_scraping: bool = False) -> None:
+@celery.task(name='tasks.scraping', bind=True)
+def scrape(self, force_scraping: bool = False) -> Optional[str]:
     """A task that would scrape and update all necessary data about restaurant menus.
 
+    Every restaurant is scraped by its own `scrape_restaurant` task (in the scraping queue), statistics of
+    the whole run are recorded by `finish_scraping` once all of them are done.
+
     :param force_scraping: If `True` all menus will be scared no matter how old data are.
 
-    NOTE: Task time limit is 30 minutes.
+    Returns ID of the run or `None` if other scraping run was already in progress.
     """
 
+    run_id: str = self.request.id or uuid.uuid4().hex
+    lock: LeaseLock = _scraping_run_lock(owner=run_id)
+    if lock.acquire() is None:
+        running_job_id: Optional[str] = lock.holder
+        logging.info(f'Scraping job {running_job_id} is already in progress, skipping.')
+        _record_job(run_id, 'SKIPPED', coalesced_with=running_job_id)
+        return None
+
+    _record_job(run_id, 'STARTED')
+
     logging.info(f'Scraping task was executed. Updating data from {len(RESTAURANTS)} restaurants.')
 
-    start_time: float = time.time()
+    try:
+        # Callback is not executed when some restaurant task fails, the errback ends the run then
+        chord(
+            scrape_restaurant.s(restaurant.restaurant_id(), force_scraping) for restaurant in RESTAURANTS
+        )(finish_scraping.s(run_id=run_id, started_at=time.time()).on_error(abort_scraping.si(run_id=run_id)))
+    except Exception:
+        lock.release()  # Nothing was dispatched, the run is over
+        _record_job(run_id, 'FAILURE')
+        raise
+
+    return run_id
+
+
+@celery.task(name='tasks.scrape_restaurant', acks_late=True, soft_time_limit=SCRAPING_LOCK_TTL)
+def scrape_restaurant(restaurant_id: int, force_scraping: bool = False) -> dict:
+    """Scrape a single restaurant and publish its result right away, day views are rebuilt (or built when
+    they are missing), so slow restaurants never hold back the others.
+    """
+
+    result: dict = RestaurantsFactory.scrape_restaurant(RESTAURANTS_BY_ID[restaurant_id], force_scraping)
 
-    # Execute scraping on all restaurants
-    failed: int = RestaurantsFactory.execute_scraping(force_scraping)
+    try:
+        if result['status'] == 'success' or not has_day_views(get_redis_client()):
+            RestaurantsFactory.build_day_views()
+    except Exception as exc:
+        logging.error(f'Building of day views failed with exception: {str(exc)}.')
+        logging.debug(f'Exception trace for day views: {traceback.format_exc()}.')
+
+    return result
+
+
+@celery.task(name='tasks.finish_scraping')
+def finish_scraping(results: List[dict], run_id: str, started_at: float) -> int:
+    """Aggregate results of all restaurants, record statistics of the run and end it.
+
+    Returns amount of failed scrapers.
+    """
 
-    logging.info(f'Scraping was done in {(time.time() - start_time):.2f}s, {failed} scrapers failed.')
+    statuses: Dict[str, int] = dict(Counter(result['status'] for result in results))
+    stats: dict = {
+        'run_id': run_id,
+        'started_at': started_at,
+        'finished_at': time.time(),
+        'duration': time.time() - started_at,
+        'scraping_time': sum(result['duration'] for result in results),
+        'restaurants': len(results),
+        'failed': sum(count for status, count in statuses.items() if status in FAILED_STATUSES),
+        'statuses': statuses,
+        'slowest': max(results, key=lambda result: result['duration'])['restaurant'] if results else None,
+    }
+
+    pipeline = get_redis_client().pipeline()
+    pipeline.set(_run_stats_key(run_id), json.dumps(stats), ex=SCRAPING_RUN_STATS_TTL)
+    pipeline.lpush('scraping-runs', json.dumps(stats))
+    pipeline.ltrim('scraping-runs', 0, SCRAPING_RUNS_LIMIT - 1)
+    pipeline.execute()
+
+    _scraping_run_lock(owner=run_id).release()
+
+    logging.info(f'Scraping was done in {stats["duration"]:.2f}s, {stats["failed"]} scrapers failed.')
+    return stats['failed']
+
+
+@celery.task(name='tasks.abort_scraping')
+def abort_scraping(run_id: str) -> None:
+    """Errback of the run, end the run when some restaurant task failed (`finish_scraping` is not executed)."""
+
+    logging.error(f'Scraping run {run_id} failed, its statistics were not recorded.')
+    _record_job(run_id, 'FAILURE')
+    _scraping_run_lock(owner=run_id).release()
@@ -9,22 +9,25 @@ from __future__ import annotations
 
 import os
 import uuid
-import pytesseract
 
 from collections import defaultdict
 from copy import deepcopy
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
 from enum import Enum
 from functools import wraps
-from flask import Request, abort
-from flask_restful import fields, reqparse
+from flask import Request
+from flask_restful import abort, fields, inputs, reqparse
+from werkzeug.wrappers import Response as BaseResponse
 from flask import request as flask_request
-from PIL import Image
+
+from config import OFFICES, TIMEZONE
 
 from typing import TYPE_CHECKING, Iterable
 
 import urllib3
 if TYPE_CHECKING:
-    from typing import List, Callable, Optional
+    from typing import List, Callable, Optional, Union
 
 
 BRNO_CITY_CODE_ADDRESS: str = 'Brno (602 00)'
@@ -34,10 +37,10 @@ TEMP_FILE_PATH: str = os.path.join(os.path.realpath(__file__), 'temp')
 class WeekDays(Enum):
 
     MONDAY: str = 'Monday'
-    TUESDAY: str = 'Tuesday',
+    TUESDAY: str = 'Tuesday'
     WEDNESDAY: str = 'Wednesday'
-    THURSDAY: str = 'Thursday',
-    FRIDAY: str = 'Friday',
+    THURSDAY: str = 'Thursday'
+    FRIDAY: str = 'Friday'
     # NOTE: We would not count here Sunday or Saturday
 
     def __str__(self) -> str:
@@ -54,12 +57,82 @@ class WeekDays(Enum):
     def is_valid_day(day_str) -> bool:
         return day_str in WeekDays.all_days()
 
+    @staticmethod
+    def from_date(_date: date) -> str:
+        """Name of the week day of the date (also for weekends which are not members)."""
+
+        return _date.strftime('%A')
+
     def __hash__(self) -> int:
         return hash(self.value)
 
 
+# Day values representing the whole week
+ALL_DAYS_VALUES: List[str] = ['all', '']
+# Days without menus, they are resolved (e.g. `today` on Saturday) but served with empty meals
+WEEKEND_DAYS: List[str] = ['Saturday', 'Sunday']
+
+
+def local_today() -> date:
+    """Current date in the local (restaurants) timezone."""
+
+    return datetime.now(ZoneInfo(TIMEZONE)).date()
+
+
+def week_date(day: str, reference: Optional[date] = None) -> date:
+    """Date of the week day in the menu week of the reference date (local today by default).
+
+    Restaurants publish menus of the next week over the weekend, so on Saturday and Sunday the menu week
+    is the next one.
+    """
+
+    reference = reference or local_today()
+    if reference.weekday() >= len(WeekDays.all_days()):
+        reference += timedelta(days=7)
+    monday: date = reference - timedelta(days=reference.weekday())
+    return monday + timedelta(days=WeekDays.all_days().index(day))
+
+
+def resolve_day(value: Optional[str], today: Optional[date] = None) -> Optional[str]:
+    """Resolve requested day to the name of the week day, `None` represents the whole week.
+
+    Accepts week day names (case insensitive), `today`, `tomorrow`, `all` and ISO dates of the current week.
+    Weekend days are resolved to their names as well (see `WEEKEND_DAYS`). Raises `ValueError` for unknown values.
+    """
+
+    if value is None or value.strip().lower() in ALL_DAYS_VALUES:
+        return None
+
+    value = value.strip().lower()
+    today = today or local_today()
+
+    if value == 'today':
+        return WeekDays.from_date(today)
+    if value == 'tomorrow':
+        return WeekDays.from_date(today + timedelta(days=1))
+
+    for day in WeekDays.all_days() + WEEKEND_DAYS:
+        if value == day.lower():
+            return day
+
+    try:
+        requested: date = date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Unknown day: {value}')
+
+    # Only menus of the current week are stored
+    if requested.isocalendar()[:2] != today.isocalendar()[:2]:
+        raise ValueError(f'Menus are available only for the current week, not for {value}.')
+
+    return WeekDays.from_date(requested)
+
+
+def create_address(street_address: str, city: str) -> str:
+    return f'{street_address}, {city}'
+
+
 def create_brno_like_address(street_address: str) -> str:
-    return f'{street_address}{BRNO_CITY_CODE_ADDRESS}'
+    return create_address(street_address, BRNO_CITY_CODE_ADDRESS)
 
 
 def filter_dict(d, include: Optional[Iterable] = None, omit: Optional[Iterable] = None) -> dict:
@@ -123,6 +196,16 @@ def filter_fields(d: dict, include_fields: Iterable[str]) -> dict:
     return filter_dict(d, flat)
 
 
+class DayField(fields.String):
+    """Day field, resolves relative days and dates to the name of the week day (see `resolve_day`)."""
+
+    def parse(self, value) -> str:
+        try:
+            return resolve_day(str(value)) or 'all'
+        except ValueError as exc:
+            raise fields.MarshallingException(str(exc))
+
+
 class EnumField(fields.String):
     """Enum field."""
 
@@ -139,60 +222,208 @@ class EnumField(fields.String):
         return value
 
 
+class RangeField(fields.Raw):
+    """Number field limited to the range (bounds are inclusive, `None` is unbounded)."""
+
+    def __init__(self, number_type: Callable[[object], Union[int, float]] = float, minimum: Optional[float] = None,
+                 maximum: Optional[float] = None, *args, **kwargs) -> None:
+        self._number_type: Callable[[object], Union[int, float]] = number_type
+        self._minimum: float = float('-inf') if minimum is None else minimum
+        self._maximum: float = float('inf') if maximum is None else maximum
+        super(RangeField, self).__init__(*args, **kwargs)
+
+    def parse(self, value) -> Union[int, float]:
+        try:
+            number: Union[int, float] = self._number_type(value)
+        except (TypeError, ValueError):
+            raise fields.MarshallingException(f'Number expected, got {value}')
+
+        # NaN fails the comparison too
+        if not self._minimum <= number <= self._maximum:
+            if self._maximum == float('inf'):
+                raise fields.MarshallingException(f'Number greater than or equal to {self._minimum} expected')
+            raise fields.MarshallingException(f'Number in range {self._minimum}..{self._maximum} expected')
+
+        return number
+
+
+class MappingField(fields.Raw):
+    """Field of a dict with arbitrary keys (e.g. week days), all values are formatted by the container field."""
+
+    def __init__(self, container, *args, **kwargs) -> None:
+        self.container = container() if isinstance(container, type) else container
+        super(MappingField, self).__init__(*args, **kwargs)
+
+    def format(self, value) -> dict:
+        return {str(key): self.container.output(key, value) for key in value}
+
+
+def _compile_formatter(field) -> Callable[[object], object]:
+    """Compile field definition into function formatting already extracted value."""
+
+    if isinstance(field, type):
+        field = field()
+
+    if isinstance(field, dict):
+        return _compile_schema(field)
+
+    if isinstance(field, fields.Nested):
+        marshal_nested: Callable[[object], dict] = _compile_schema(field.nested)
+        return lambda value: None if value is None and field.allow_null else marshal_nested(value)
+
+    if isinstance(field, fields.List):
+        format_item: Callable[[object], object] = _compile_formatter(field.container)
+        return lambda value: field.default if value is None else [format_item(item) for item in value]
+
+    if isinstance(field, MappingField):
+        format_value: Callable[[object], object] = _compile_formatter(field.container)
+        return lambda value: field.default if value is None else {
+            str(key): format_value(item) for key, item in value.items()
+        }
+
+    return lambda value: field.default if value is None else field.format(value)
+
+
+def _compile_getter(key: str, field) -> Callable[[object], object]:
+    """Compile function extracting value of the field from marshalled object."""
+
+    if isinstance(field, dict):
+        return lambda obj: obj  # Nested schema is marshalled from the same object
+
+    attribute = getattr(field, 'attribute', None) or key
+    if callable(attribute) or '.' in attribute:
+        return lambda obj: fields.get_value(attribute, obj)
+
+    return lambda obj: obj.get(attribute) if isinstance(obj, dict) else getattr(obj, attribute, None)
+
+
+def _compile_schema(schema: dict) -> Callable[[object], dict]:
+    """Compile schema (dict of fields as used by `flask_restful.marshal`) into marshalling function.
+
+    Fields are instantiated and resolved only once, so marshalling does not walk field definitions again.
+    """
+
+    compiled: list = []
+    for key, field in schema.items():
+        field = field() if isinstance(field, type) else field
+        compiled.append((key, _compile_getter(key, field), _compile_formatter(field)))
+
+    def marshal(obj: object) -> dict:
+        if obj is None:
+            return {key: format_value(None) for key, _, format_value in compiled}
+
+        return {key: format_value(get_value(obj)) for key, get_value, format_value in compiled}
+
+    return marshal
+
+
+class MarshalWith:
+    """Method decorator marshalling output by the schema which is compiled only once.
+
+    Responses which are already serialized (e.g. precomputed views) are returned as they are.
+    """
+
+    def __init__(self, schema: dict) -> None:
+        self.schema: dict = schema
+        self.marshal: Callable[[object], dict] = _compile_schema(schema)
+
+    def __call__(self, view) -> Callable:
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            response = view(*args, **kwargs)
+
+            if isinstance(response, BaseResponse):
+                return response  # Fast path, nothing to marshal
+
+            if isinstance(response, tuple):
+                return (self.marshal(response[0]),) + response[1:]
+
+            return self.marshal(response)
+
+        return wrapper
+
+
+def _parse_type(field) -> Callable[[object], object]:
+    """Function converting input value of the field."""
+
+    if hasattr(field, 'parse'):
+        return field.parse
+    if isinstance(field, fields.Boolean):
+        return inputs.boolean
+    if isinstance(field, fields.Integer):
+        return int
+    if isinstance(field, fields.Float):
+        return float
+
+    return str
+
+
 class CoerceWith:
-    """Method decorator to simplify validation of input data."""
+    """Method decorator to simplify validation of input data.
+
+    Coerced values are passed to the method as keyword arguments.
+    """
 
     RESTAURANT_FIELDS: dict = {
-        'day': EnumField(WeekDays.all_days() + ['all'], default='all'),
-        'restaurant': fields.String
+        'day': DayField(default='all'),
+        'restaurant': fields.String,
+        'lat': RangeField(minimum=-90, maximum=90),
+        'lon': RangeField(minimum=-180, maximum=180),
+        'radius': RangeField(int, minimum=1),
+        'office': EnumField(list(OFFICES)),
+        'compact': fields.Boolean,
     }
 
     def __init__(self, coerce_fields: dict, location: str = 'json') -> None:
-        self.fields: dict = coerce_fields
+        self.fields: dict = {name: field() if isinstance(field, type) else field
+                             for name, field in coerce_fields.items()}
         self.location: str = location
+        self._parser: reqparse.RequestParser = self._build_parser(self.fields)
 
     def __call__(self, view) -> Callable:
         @wraps(view)
         def wrapper(obj_self, *args, **kwargs):
-            return view(
-                obj_self,
-                self._coerce_input(),
-                *args, **kwargs
-            )
+            return view(obj_self, *args, **dict(self._coerce_input(), **kwargs))
 
         return wrapper
 
+    def _build_parser(self, fields_data: dict) -> reqparse.RequestParser:
+        """Construct `RequestParser` according to fields, so input validation is fully automatic and very
+        similar to output marshalling.
+        """
+
+        parser: reqparse.RequestParser = reqparse.RequestParser()
+        for name, field in fields_data.items():
+            parser.add_argument(
+                name, type=_parse_type(field), default=field.default, required=getattr(field, 'required', False),
+                location=self.location, dest=field.attribute or name,
+                help=f'Field {name} is not in required format: {{error_msg}}'
+            )
+
+        return parser
+
     def _coerce_input(self, request: Optional[Request] = None) -> dict:
         """Helper simplifying validation of input data.
 
-        Function takes *fields_data* dict with fields_data and constructs RequestParser` according
-        to those. Thus, input validation is fully automatic and very similar to output marshalling.
-        Returns only items which are not `None`.
+        Returns only items which are not `None` (unless the field is nullable).
         """
 
-        parser: reqparse.RequestParser = reqparse.RequestParser()
         request: Request = request or flask_request
 
         content_type: str = request.headers.get('Content-Type', '')
         if self.location == 'json' and 'application/json' not in content_type:
-            abort(400, message="Bad Content-Type, JSON expected.")
+            abort(400, message='Bad Content-Type, JSON expected.')
 
+        fields_data: dict = self.fields
+        parser: reqparse.RequestParser = self._parser
         if request.method in ['PATCH', 'PUT']:
             # Allow partial update
             incoming_keys: list = list(getattr(request, self.location).keys())
-            fields_data: dict = filter_fields(self.fields, incoming_keys)
+            fields_data = filter_fields(self.fields, incoming_keys)
+            parser = self._build_parser(fields_data)
 
         # Allow None values for selected fields
-        nullables: set = set()
-        for name, field in fields_data.items():
-            if field.nullable:
-                nullables.add(name)
-
-            parser.add_argument(
-                name, type=field.parse, default=field.default, required=field.required,
-                location=self.location, dest=field.attribute or name,
-                help=f'Field {name} is not in required format.'
-            )
+        nullables: set = {name for name, field in fields_data.items() if getattr(field, 'nullable', False)}
 
         data: dict = parser.parse_args(req=request)
         return {k: v for k, v in data.items() if v is not None or k in nullables}
@@ -208,4 +439,8 @@ def download_image(url: str) -> None:
 def image_to_text(image_name: str) -> str:
     """Retrieve text from image and returns it."""
 
+    # NOTE: OCR dependencies are heavy and only scrapers need them, so they are imported lazily
+    import pytesseract
+    from PIL import Image
+
     return pytesseract.image_to_string(Image.open(os.path.join(TEMP_FILE_PATH, image_name)))
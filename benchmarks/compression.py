@@ -0,0 +1,140 @@
+"""
+Compression benchmark
+=====================
+
+Measure bytes on the wire and CPU time per request of `/restaurants` responses: the former JSON encoding
+(`json.dumps` as used by Flask-RESTful), compact JSON, compression of dynamic responses on every request
+and precomputed (precompressed) views.
+
+Usage: `python benchmarks/compression.py [--restaurants 12] [--requests 200] [--output compression.json]`
+
+NOTE: Payload is synthetic (the week menu of every restaurant), Redis is not needed.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from typing import Callable, Dict, List, Tuple
+
+
+APP_DIR: str = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'app')
+sys.path.insert(0, APP_DIR)
+
+from encoding import ENCODINGS, IDENTITY, compress_variants, dumps_json, encode_dynamic, orjson  # noqa: E402
+
+
+DAYS: List[str] = ['Pondělí', 'Úterý', 'Středa', 'Čtvrtek', 'Pátek']
+WORDS: List[str] = [
+    'hovězí', 'vývar', 's', 'nudlemi', 'kuřecí', 'řízek', 'bramborový', 'salát', 'svíčková', 'na', 'smetaně',
+    'knedlík', 'gulášová', 'polévka', 'smažený', 'sýr', 'hranolky', 'tatarská', 'omáčka', 'pečená', 'kachna',
+    'zelí', 'rizoto', 'se', 'zeleninou', 'čočka', 'nakyselo', 'vejce', 'okurka', 'pad', 'thai', 'curry',
+]
+
+ACCEPT_ENCODINGS: Dict[str, str] = {'br': 'gzip, deflate, br', 'gzip': 'gzip, deflate', IDENTITY: ''}
+
+
+def _meal(generator: random.Random, is_soup: bool) -> dict:
+    return {
+        'name': ' '.join(generator.choice(WORDS) for _ in range(generator.randint(3, 7))).capitalize(),
+        'price': float(generator.choice([35, 45, 129, 139, 149, 159, 169, 189])),
+        'description': ' '.join(generator.choice(WORDS) for _ in range(generator.randint(0, 10))) or None,
+        'alergens': sorted(generator.sample(range(1, 15), generator.randint(0, 4))),
+        'is_vegan': generator.random() < 0.1,
+        'is_gluten_free': generator.random() < 0.1,
+        'is_soup': is_soup,
+    }
+
+
+def build_payload(restaurants: int, seed: int = 42, days: List[str] = DAYS) -> dict:
+    """Response of `/restaurants` for the whole week."""
+
+    generator: random.Random = random.Random(seed)
+    data: List[dict] = [{
+        'name': f'Restaurace {index}',
+        'url': f'https://restaurant-{index}.example.com/denni-menu',
+        'accepts_cards': generator.random() < 0.8,
+        'last_scrape': '2024-03-04 10:15:42.123456',
+        'address': f'Náměstí Míru {index}, Brno (602 00)',
+        'meals': {day: [_meal(generator, position == 0) for position in range(generator.randint(4, 9))]
+                  for day in days},
+    } for index in range(restaurants)]
+
+    return {'loaded_scrapers': restaurants, 'data_size': len(data), 'data': data}
+
+
+def _measure(handler: Callable[[], bytes], requests: int) -> Tuple[int, float]:
+    """Size of the response body (bytes) and CPU time per request (microseconds)."""
+
+    body: bytes = handler()
+    start: float = time.process_time()
+    for _ in range(requests):
+        handler()
+
+    return len(body), (time.process_time() - start) / requests * 1_000_000
+
+
+def main() -> int:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--restaurants', type=int, default=12, help='Amount of restaurants in the response.')
+    parser.add_argument('--requests', type=int, default=200, help='Amount of measured requests per scenario.')
+    parser.add_argument('--output', help='Path of JSON file with results (e.g. to track them in CI).')
+    args = parser.parse_args()
+
+    payload: dict = build_payload(args.restaurants)
+
+    start: float = time.process_time()
+    variants: Dict[str, bytes] = compress_variants(dumps_json(payload))
+    precompute_ms: float = (time.process_time() - start) * 1000
+
+    scenarios: Dict[str, Callable[[], bytes]] = {
+        'json (former, pretty in debug)': lambda: (json.dumps(payload, indent=4) + '\n').encode('utf-8'),
+        'json (former)': lambda: (json.dumps(payload) + '\n').encode('utf-8'),
+        'compact json': lambda: dumps_json(payload),
+    }
+    for encoding in ENCODINGS:
+        if encoding == IDENTITY:
+            continue
+
+        accept_encoding: str = ACCEPT_ENCODINGS[encoding]
+        scenarios[f'dynamic {encoding}'] = (
+            lambda accept_encoding=accept_encoding: encode_dynamic(dumps_json(payload), accept_encoding)[0]
+        )
+    for encoding in ENCODINGS:
+        scenarios[f'precomputed {encoding}'] = lambda encoding=encoding: variants[encoding]
+
+    results: Dict[str, dict] = {}
+    for name, handler in scenarios.items():
+        size, cpu_us = _measure(handler, args.requests)
+        results[name] = {'bytes': size, 'cpu_us_per_request': cpu_us}
+
+    baseline: int = results['json (former)']['bytes']
+    print(f'Response of {args.restaurants} restaurants (whole week, JSON encoder: '
+          f'{"orjson" if orjson is not None else "json"}, {args.requests} requests):')
+    print(f'  {"scenario":32} {"bytes":>10} {"ratio":>7} {"CPU/request":>14}')
+    for name, result in results.items():
+        print(f'  {name:32} {result["bytes"]:>10} {result["bytes"] / baseline:>7.2f} '
+              f'{result["cpu_us_per_request"]:>11.1f} us')
+    print(f'  precomputing of all variants (once per scraping): {precompute_ms:.1f} ms')
+
+    if args.output:
+        summary: dict = {
+            'restaurants': args.restaurants,
+            'requests': args.requests,
+            'encoder': 'orjson' if orjson is not None else 'json',
+            'precompute_ms': precompute_ms,
+            'scenarios': results,
+        }
+        with open(args.output, 'w') as output:
+            json.dump(summary, output, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
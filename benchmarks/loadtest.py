@@ -0,0 +1,326 @@
+"""
+Load test
+=========
+
+Measure how many requests a single web process sustains: throughput, latency percentiles and memory
+of the process for `/`, `/restaurants` (with different filters) and `/force-scraping` at increasing concurrency.
+
+Usage: `python benchmarks/loadtest.py [--restaurants 12 100 1000] [--concurrency 1 4 16 64] [--duration 10]
+[--redis redis://localhost:6379/15 | --fakeredis] [--output baseline.json] [--baseline baseline.json]`
+
+For every amount of restaurants the web process is started from scratch. It replaces the registry by synthetic
+restaurants, seeds Redis with their menus, builds day views and serves the app by a threaded WSGI server
+(a single process, like one gunicorn worker). Forced scraping only takes the run lock and coalesces requests,
+the Celery task is never sent.
+
+NOTE: Seeding flushes the Redis database, never point it to production. fakeredis needs Lua support
+(`pip install fakeredis[lua]`). Results are comparable only when measured on the same machine.
+"""
+
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from typing import Dict, List, Optional
+
+from compression import APP_DIR, build_payload  # Also adds the app directory to the path
+
+
+# Requested paths (`restaurant` filter matches exactly one synthetic restaurant)
+SCENARIOS: Dict[str, str] = {
+    'root': '/',
+    'restaurants': '/restaurants',
+    'restaurants-day': '/restaurants?day=Monday',
+    'restaurants-today': '/restaurants?day=today',
+    'restaurants-filtered': '/restaurants?day=Tuesday&restaurant=Restaurace%200',
+    'force-scraping': '/force-scraping',
+}
+
+STARTUP_TIMEOUT: float = 300.0  # Seconds, seeding of many restaurants takes a while
+ACCEPT_ENCODING: str = 'gzip, br'
+
+
+def setup_app(restaurants: int, redis_url: str, use_fakeredis: bool):
+    """Seed Redis with synthetic restaurants and return the Flask app using it.
+
+    NOTE: It has to be called before any module of the app is imported (they have to use the selected Redis).
+    """
+
+    import logging
+
+    os.environ['ARCHIVE_PATH'] = os.path.join(tempfile.mkdtemp(), 'archive.sqlite3')
+
+    import config
+    config.DEBUG_MODE = True  # Forced scraping is available only in debug mode
+
+    if use_fakeredis:
+        import fakeredis
+        client = fakeredis.FakeRedis()
+    else:
+        import redis
+        client = redis.Redis.from_url(redis_url)
+
+    # Every module has to use the selected Redis, so it is replaced before they are imported
+    import storage
+    storage.get_redis_client = lambda: client
+    client.flushdb()
+
+    from restaurants import RESTAURANTS, RESTAURANTS_BY_ID, BaseRestaurant, RestaurantMeal, RestaurantsFactory
+    from utility import WeekDays
+
+    synthetic: list = []
+    for index, data in enumerate(build_payload(restaurants, days=WeekDays.all_days())['data']):
+        restaurant = type(f'LoadTestRestaurant{index}', (BaseRestaurant,), {
+            '_NAME': data['name'], '_URL': data['url'], '_ADDRESS': data['address'], 'scrape': lambda self: True,
+        })
+        synthetic.append(restaurant)
+
+        meals: dict = {day: [RestaurantMeal.from_dict(meal) for meal in day_meals]
+                       for day, day_meals in data['meals'].items()}
+        storage.save_days(client, restaurant.restaurant_id(), RestaurantMeal.serialize_meals(meals))
+        client.set(storage.last_scraping_key(restaurant.restaurant_id(), restaurant._NAME), time.time())
+
+    RESTAURANTS[:] = synthetic
+    RESTAURANTS_BY_ID.clear()
+    RESTAURANTS_BY_ID.update({restaurant.restaurant_id(): restaurant for restaurant in synthetic})
+    RestaurantsFactory.build_day_views()
+
+    import tasks
+    tasks.scrape.apply_async = lambda *args, **kwargs: None  # Scraping itself is not measured
+
+    import app
+
+    # Logging of every request would dominate the output
+    logging.getLogger().setLevel(logging.ERROR)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    return app.app
+
+
+def serve(port: int, restaurants: int, redis_url: str, use_fakeredis: bool) -> None:
+    """Seed Redis with synthetic restaurants and serve the app (runs in the measured web process)."""
+
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    flask_app = setup_app(restaurants, redis_url, use_fakeredis)
+
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'  # Keep-alive connections (as behind a proxy)
+    make_server('127.0.0.1', port, flask_app, threaded=True).serve_forever()
+
+
+def _free_port() -> int:
+    with socket.socket() as _socket:
+        _socket.bind(('127.0.0.1', 0))
+        return _socket.getsockname()[1]
+
+
+def _memory_mib(pid: int) -> Dict[str, Optional[float]]:
+    """Current and peak RSS of the process (Linux only)."""
+
+    memory: Dict[str, Optional[float]] = {'rss_mib': None, 'peak_rss_mib': None}
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    memory['rss_mib'] = int(line.split()[1]) / 1024
+                elif line.startswith('VmHWM:'):
+                    memory['peak_rss_mib'] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    return memory
+
+
+def _request(connection: http.client.HTTPConnection, path: str) -> bool:
+    connection.request('GET', path, headers={'Accept-Encoding': ACCEPT_ENCODING})
+    response: http.client.HTTPResponse = connection.getresponse()
+    response.read()
+    return response.status < 400
+
+
+def _wait_for_server(port: int, process: subprocess.Popen) -> None:
+    deadline: float = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Web process exited with code {process.returncode}.')
+
+        try:
+            if _request(http.client.HTTPConnection('127.0.0.1', port, timeout=5), '/'):
+                return
+        except OSError:
+            time.sleep(0.5)
+
+    raise RuntimeError('Web process did not start in time.')
+
+
+def _client(port: int, path: str, deadline: float, latencies: List[float], errors: List[int]) -> None:
+    """Send requests one by one over a keep-alive connection until the deadline."""
+
+    connection: http.client.HTTPConnection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    _latencies: List[float] = []
+    _errors: int = 0
+
+    while time.perf_counter() < deadline:
+        start: float = time.perf_counter()
+        try:
+            succeeded: bool = _request(connection, path)
+        except (OSError, http.client.HTTPException):
+            succeeded = False
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+
+        if succeeded:
+            _latencies.append(time.perf_counter() - start)
+        else:
+            _errors += 1
+
+    connection.close()
+    latencies.extend(_latencies)
+    errors.append(_errors)
+
+
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    if not sorted_values:
+        return 0.0
+
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percentile / 100))]
+
+
+def measure(port: int, pid: int, path: str, concurrency: int, duration: float) -> dict:
+    """Drive the path by concurrent clients for the duration."""
+
+    latencies: List[float] = []
+    errors: List[int] = []
+    deadline: float = time.perf_counter() + duration
+    clients: List[threading.Thread] = [
+        threading.Thread(target=_client, args=(port, path, deadline, latencies, errors))
+        for _ in range(concurrency)
+    ]
+
+    start: float = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed: float = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'throughput_rps': len(latencies) / elapsed,
+        'latency_ms': {f'p{percentile}': _percentile(latencies, percentile) * 1000 for percentile in (50, 90, 99)},
+        **_memory_mib(pid),
+    }
+
+
+def run(restaurants: int, args: argparse.Namespace) -> dict:
+    """Start the web process with the amount of restaurants and measure all scenarios."""
+
+    port: int = _free_port()
+    command: List[str] = [sys.executable, os.path.realpath(__file__), '--serve', str(port),
+                          '--restaurants', str(restaurants), '--redis', args.redis]
+    if args.fakeredis:
+        command.append('--fakeredis')
+
+    process: subprocess.Popen = subprocess.Popen(command, cwd=APP_DIR)
+    try:
+        _wait_for_server(port, process)
+        result: dict = {'startup': _memory_mib(process.pid), 'scenarios': {}}
+
+        for scenario, path in SCENARIOS.items():
+            result['scenarios'][scenario] = {}
+            for concurrency in args.concurrency:
+                level: dict = measure(port, process.pid, path, concurrency, args.duration)
+                result['scenarios'][scenario][str(concurrency)] = level
+                print(f'  {restaurants:>5} restaurants  {scenario:22} c={concurrency:<4} '
+                      f'{level["throughput_rps"]:>9.1f} req/s  p50 {level["latency_ms"]["p50"]:>8.2f} ms  '
+                      f'p99 {level["latency_ms"]["p99"]:>8.2f} ms  errors {level["errors"]:<5} '
+                      f'RSS {level["rss_mib"] or 0:.1f} MiB')
+    finally:
+        process.terminate()
+        process.wait()
+
+    return result
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Regressions against the baseline (throughput lower or p99 latency higher than the tolerance)."""
+
+    regressions: List[str] = []
+    for restaurants, result in results['runs'].items():
+        for scenario, levels in result['scenarios'].items():
+            for concurrency, level in levels.items():
+                base: Optional[dict] = baseline.get('runs', {}).get(restaurants, {}).get('scenarios', {}) \
+                    .get(scenario, {}).get(concurrency)
+                if base is None:
+                    continue
+
+                name: str = f'{scenario} ({restaurants} restaurants, concurrency {concurrency})'
+                if level['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+                    regressions.append(f'{name}: throughput {level["throughput_rps"]:.1f} req/s, '
+                                       f'baseline {base["throughput_rps"]:.1f} req/s')
+                if level['latency_ms']['p99'] > base['latency_ms']['p99'] * (1 + tolerance):
+                    regressions.append(f'{name}: p99 latency {level["latency_ms"]["p99"]:.2f} ms, '
+                                       f'baseline {base["latency_ms"]["p99"]:.2f} ms')
+                if level['errors'] > base['errors']:
+                    regressions.append(f'{name}: {level["errors"]} errors, baseline {base["errors"]}')
+
+    return regressions
+
+
+def main() -> int:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--restaurants', type=int, nargs='+', default=[12, 100, 1000],
+                        help='Amounts of seeded restaurants.')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64],
+                        help='Amounts of concurrent clients.')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds of every measurement.')
+    parser.add_argument('--redis', default='redis://localhost:6379/15', help='Redis database which is seeded.')
+    parser.add_argument('--fakeredis', action='store_true', help='Use in-memory fakeredis instead of Redis.')
+    parser.add_argument('--output', help='Path of JSON file with results (e.g. a new baseline).')
+    parser.add_argument('--baseline', help='Path of JSON file with the baseline, regressions fail the run.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression.')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)  # Port of the measured web process
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.restaurants[0], args.redis, args.fakeredis)
+        return 0
+
+    results: dict = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'duration': args.duration,
+        'redis': 'fakeredis' if args.fakeredis else args.redis,
+        'runs': {str(restaurants): run(restaurants, args) for restaurants in args.restaurants},
+    }
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions: List[str] = compare(results, json.load(baseline_file), args.tolerance)
+
+        for regression in regressions:
+            print(f'REGRESSION: {regression}')
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Marshalling benchmark
+=====================
+
+Measure throughput of building `/restaurants` response bodies: marshalling by `flask_restful.marshal`
+(field definitions are walked on every request) and marshalling by the compiled schema. Then both paths
+of the resource are compared on equal terms (whole requests through the test client of the app): responses
+marshalled on every request (`restaurant` filter) and the fast path serving precomputed views as they are.
+
+Usage: `python benchmarks/marshalling.py [--restaurants 12] [--requests 500] [--redis redis://localhost:6379/15 |
+--fakeredis] [--output marshalling.json]`
+
+NOTE: Payload is synthetic (see `compression.py` and `loadtest.py`). Seeding flushes the Redis database,
+never point it to production.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+
+from typing import Callable, Dict
+
+from compression import build_payload  # Also adds the app directory to the path
+from loadtest import setup_app
+
+
+# Requested paths, the filter matches all synthetic restaurants, so both responses contain the same data
+RESOURCE_PATHS: Dict[str, str] = {
+    'marshalled (/restaurants?restaurant=)': '/restaurants?restaurant=Restaurace',
+    'precomputed view (/restaurants)': '/restaurants',
+}
+
+
+def _throughput(handler: Callable[[], bytes], requests: int) -> float:
+    """Requests per second (single thread)."""
+
+    handler()
+    start: float = time.perf_counter()
+    for _ in range(requests):
+        handler()
+
+    return requests / (time.perf_counter() - start)
+
+
+def _print_results(title: str, results: Dict[str, float]) -> None:
+    baseline: float = next(iter(results.values()))
+    print(title)
+    for name, requests_per_second in results.items():
+        print(f'  {name:40} {requests_per_second:>12.0f} req/s {requests_per_second / baseline:>8.1f}x')
+
+
+def main() -> int:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--restaurants', type=int, default=12, help='Amount of restaurants in the response.')
+    parser.add_argument('--requests', type=int, default=500, help='Amount of measured requests per path.')
+    parser.add_argument('--redis', default='redis://localhost:6379/15', help='Redis database which is seeded.')
+    parser.add_argument('--fakeredis', action='store_true', help='Use in-memory fakeredis instead of Redis.')
+    parser.add_argument('--output', help='Path of JSON file with results (e.g. to track them in CI).')
+    args = parser.parse_args()
+
+    # App modules are imported only after Redis is selected and seeded
+    flask_app = setup_app(args.restaurants, args.redis, args.fakeredis)
+
+    from flask_restful import marshal
+    from encoding import dumps_json
+    from restaurants import RESTAURANTS_RESPONSE
+
+    payload: dict = build_payload(args.restaurants)
+    marshalling: Dict[str, Callable[[], bytes]] = {
+        'flask_restful.marshal': lambda: (json.dumps(marshal(payload, RESTAURANTS_RESPONSE.schema)) + '\n').encode(),
+        'compiled schema': lambda: dumps_json(RESTAURANTS_RESPONSE.marshal(payload)),
+    }
+
+    client = flask_app.test_client()
+    bodies: Dict[str, bytes] = {name: client.get(path).get_data() for name, path in RESOURCE_PATHS.items()}
+    resource: Dict[str, Callable[[], bytes]] = {
+        name: lambda path=path: client.get(path).get_data() for name, path in RESOURCE_PATHS.items()
+    }
+
+    results: Dict[str, Dict[str, float]] = {
+        'marshalling': {name: _throughput(handler, args.requests) for name, handler in marshalling.items()},
+        'resource': {name: _throughput(handler, args.requests) for name, handler in resource.items()},
+    }
+
+    _print_results(f'Marshalling of the response of {args.restaurants} restaurants (whole week, '
+                   f'{args.requests} requests):', results['marshalling'])
+    _print_results(f'Requests of /restaurants with {args.restaurants} restaurants (whole week, test client, '
+                   f'{args.requests} requests, identical bodies: {len(set(bodies.values())) == 1}):',
+                   results['resource'])
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'restaurants': args.restaurants, 'requests': args.requests, 'requests_per_second': results},
+                      output, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Startup benchmark
+=================
+
+Measure cold start of the web process: import time (based on `python -X importtime`), RSS after
+startup and whether any scraping-only dependency was imported.
+
+Usage: `python benchmarks/startup.py [--module app] [--runs 5] [--output startup.json]`
+
+NOTE: Startup includes warm up of the menu cache, so Redis should be reachable for representative numbers.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from typing import Dict, List
+
+
+APP_DIR: str = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'app')
+
+# Modules which must not be imported by the web tier (they are needed only for scraping)
+SCRAPING_ONLY_MODULES: List[str] = ['selenium', 'PIL', 'pytesseract', 'psutil']
+
+# Code executed in the measured interpreter, prints JSON with RSS and imported scraping modules
+_PROBE: str = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+duration = time.perf_counter() - start
+print(json.dumps({{
+    'startup_s': duration,
+    'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    'scraping_modules': sorted({{name.split('.')[0] for name in sys.modules}} & set({forbidden!r})),
+}}))
+"""
+
+
+def _parse_importtime(stderr: str) -> Dict[str, int]:
+    """Parse `-X importtime` output into mapping of module and its cumulative import time (us)."""
+
+    cumulative: Dict[str, int] = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        _, cumulative_us, name = line.split('|')
+        cumulative[name.strip()] = int(cumulative_us)
+
+    return cumulative
+
+
+def measure(module: str) -> dict:
+    """Start fresh interpreter, import the module and collect startup statistics."""
+
+    process: subprocess.CompletedProcess = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _PROBE.format(module=module, forbidden=SCRAPING_ONLY_MODULES)],
+        cwd=APP_DIR, capture_output=True, text=True, check=True,
+    )
+
+    result: dict = json.loads(process.stdout.strip().splitlines()[-1])
+    imports: Dict[str, int] = _parse_importtime(process.stderr)
+    result['import_us'] = imports.get(module, 0)
+    result['slowest_imports'] = sorted(imports.items(), key=lambda item: item[1], reverse=True)[:15]
+
+    return result
+
+
+def main() -> int:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--module', default='app', help='Module representing the web process.')
+    parser.add_argument('--runs', type=int, default=5, help='Amount of measured cold starts.')
+    parser.add_argument('--output', help='Path of JSON file with results (e.g. to track them in CI).')
+    args = parser.parse_args()
+
+    runs: List[dict] = [measure(args.module) for _ in range(args.runs)]
+
+    summary: dict = {
+        'module': args.module,
+        'runs': args.runs,
+        'startup_s_median': statistics.median(run['startup_s'] for run in runs),
+        'import_ms_median': statistics.median(run['import_us'] for run in runs) / 1000,
+        'max_rss_mib_median': statistics.median(run['max_rss_kib'] for run in runs) / 1024,
+        'scraping_modules': runs[-1]['scraping_modules'],
+        'slowest_imports_ms': [(name, us / 1000) for name, us in runs[-1]['slowest_imports']],
+    }
+
+    print(f'Cold start of `{args.module}` ({args.runs} runs, median):')
+    print(f'  startup:  {summary["startup_s_median"] * 1000:.1f} ms')
+    print(f'  imports:  {summary["import_ms_median"]:.1f} ms')
+    print(f'  max RSS:  {summary["max_rss_mib_median"]:.1f} MiB')
+    print('  slowest imports (cumulative):')
+    for name, ms in summary['slowest_imports_ms']:
+        print(f'    {ms:9.1f} ms  {name}')
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(summary, output, indent=2)
+
+    if summary['scraping_modules']:
+        print(f'ERROR: web process imported scraping dependencies: {", ".join(summary["scraping_modules"])}')
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
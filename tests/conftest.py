@@ -0,0 +1,6 @@
+import os
+import sys
+
+
+# Modules of the app are imported as top level ones (as in the app directory)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'app'))
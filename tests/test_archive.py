@@ -0,0 +1,70 @@
+from datetime import date
+
+import pytest
+
+from archive import MenuArchive
+
+
+# Week from Monday 2024-03-04 to Sunday 2024-03-10
+MONDAY: date = date(2024, 3, 4)
+SATURDAY: date = date(2024, 3, 9)
+
+
+def _meal(name: str, price: float, is_soup: bool = False) -> dict:
+    return {'name': name, 'price': price, 'description': None, 'alergens': ['1'], 'is_vegan': False,
+            'is_gluten_free': False, 'is_soup': is_soup}
+
+
+@pytest.fixture
+def archive(tmp_path) -> MenuArchive:
+    return MenuArchive(str(tmp_path / 'archive.sqlite3'))
+
+
+def test_archive_day_replaces_aggregates_of_the_date(archive):
+    archive.archive_day(1, MONDAY, 1, [_meal('Gulášová polévka', 40.0, True), _meal('Řízek', 150.0)])
+    archive.archive_day(1, MONDAY, 2, [_meal('Gulášová polévka', 50.0, True), _meal('Svíčková', 170.0)])
+
+    # Only the latest snapshot of the date is counted
+    assert archive.price_trend(period='day') == [{'period': '2024-03-04', 'average_price': 110.0, 'meals': 2}]
+    assert archive.soup_price() == {'soups': 1, 'average_price': 50.0}
+    assert {dish['name']: dish['appearances'] for dish in archive.dish_frequency()} == {
+        'Gulášová polévka': 1, 'Svíčková': 1,
+    }
+
+
+def test_archive_day_ignores_archived_version(archive):
+    archive.archive_day(1, MONDAY, 1, [_meal('Řízek', 150.0)])
+    archive.archive_day(1, MONDAY, 1, [_meal('Svíčková', 170.0)])
+
+    assert [dish['name'] for dish in archive.dish_frequency()] == ['Řízek']
+
+
+def test_archive_day_counts_dates_and_restaurants(archive):
+    archive.archive_day(1, MONDAY, 1, [_meal('Řízek', 150.0)])
+    archive.archive_day(1, date(2024, 3, 5), 1, [_meal('Řízek', 130.0)])
+    archive.archive_day(2, MONDAY, 1, [_meal('Řízek', 160.0)])
+
+    assert archive.dish_frequency() == [{'name': 'Řízek', 'appearances': 3, 'average_price': 440.0 / 3,
+                                         'first_seen': '2024-03-04', 'last_seen': '2024-03-05'}]
+    assert archive.dish_frequency([2])[0]['appearances'] == 1
+
+
+def test_archive_days_of_weekend_scraping_belong_to_the_next_week(archive):
+    archive.archive_days(1, {'Monday': [_meal('Řízek', 150.0)]}, {'Monday': 1}, today=MONDAY)
+    # Menus scraped over the weekend are the ones of the next week, the ending week is kept
+    archive.archive_days(1, {'Monday': [_meal('Svíčková', 170.0)]}, {'Monday': 2}, today=SATURDAY)
+
+    assert archive.price_trend(period='day') == [
+        {'period': '2024-03-04', 'average_price': 150.0, 'meals': 1},
+        {'period': '2024-03-11', 'average_price': 170.0, 'meals': 1},
+    ]
+
+
+def test_archive_day_counts_variants_of_normalized_dish_together(archive):
+    archive.archive_day(1, MONDAY, 1, [dict(_meal('Kuřecí řízek', 150.0), dish_id='2da75336202773dd')])
+    archive.archive_day(1, date(2024, 3, 5), 1, [dict(_meal('KUŘECÍ ŘÍZEK', 150.0), dish_id='2da75336202773dd')])
+    archive.archive_day(1, date(2024, 3, 6), 1, [_meal('Kuřecí řízek', 150.0)])  # Not normalized
+
+    assert [(dish['name'], dish['appearances']) for dish in archive.dish_frequency()] == [
+        ('Kuřecí řízek', 2), ('Kuřecí řízek', 1),
+    ]
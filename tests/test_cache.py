@@ -0,0 +1,97 @@
+import json
+
+import fakeredis
+import pytest
+
+import cache
+import restaurants
+import restaurants.base_restaurant
+from cache import MenuCache
+from restaurants import RESTAURANTS
+from restaurants.models import RestaurantMeal
+from storage import save_days
+
+
+RESTAURANT_ID: int = 1
+
+
+def _data(price: float) -> dict:
+    return {'name': 'Thalie', 'meals': {'Monday': [{'name': 'Guláš', 'price': price}], 'Tuesday': []}}
+
+
+@pytest.fixture
+def client(monkeypatch) -> fakeredis.FakeRedis:
+    client: fakeredis.FakeRedis = fakeredis.FakeRedis()
+    for module in [cache, restaurants, restaurants.base_restaurant]:
+        monkeypatch.setattr(module, 'get_redis_client', lambda: client)
+    return client
+
+
+def test_menu_cache_get_and_set():
+    menu_cache: MenuCache = MenuCache()
+    menu_cache.set(RESTAURANT_ID, 'Monday', _data(100.0), {'Monday': 1})
+
+    assert menu_cache.get(RESTAURANT_ID, 'Monday') == _data(100.0)
+    assert menu_cache.get(RESTAURANT_ID, 'Tuesday') is None
+    assert menu_cache.stats()['hits'] == 1
+
+
+def test_menu_cache_evicts_least_recently_used():
+    menu_cache: MenuCache = MenuCache(max_size=2)
+    for restaurant_id in range(3):
+        menu_cache.set(restaurant_id, None, _data(100.0), {})
+
+    assert menu_cache.get(0, None) is None
+    assert menu_cache.get(2, None) == _data(100.0)
+
+
+def test_menu_cache_invalidates_only_outdated_days():
+    menu_cache: MenuCache = MenuCache()
+    menu_cache.set(RESTAURANT_ID, 'Monday', _data(100.0), {'Monday': 1, 'Tuesday': 1})
+    menu_cache.set(RESTAURANT_ID, 'Tuesday', _data(100.0), {'Monday': 1, 'Tuesday': 1})
+    menu_cache.set(RESTAURANT_ID, None, _data(100.0), {'Monday': 1, 'Tuesday': 1})
+
+    menu_cache.invalidate(RESTAURANT_ID, {'Monday': 2})
+
+    assert menu_cache.get(RESTAURANT_ID, 'Monday') is None
+    assert menu_cache.get(RESTAURANT_ID, None) is None  # Whole week contains Monday too
+    assert menu_cache.get(RESTAURANT_ID, 'Tuesday') == _data(100.0)
+
+
+def test_menu_cache_refuses_stale_data():
+    menu_cache: MenuCache = MenuCache()
+    menu_cache.invalidate(RESTAURANT_ID, {'Monday': 2})
+
+    # Data loaded before the update was announced are never cached
+    menu_cache.set(RESTAURANT_ID, 'Monday', _data(100.0), {'Monday': 1})
+    assert menu_cache.get(RESTAURANT_ID, 'Monday') is None
+
+    menu_cache.set(RESTAURANT_ID, 'Monday', _data(200.0), {'Monday': 2})
+    assert menu_cache.get(RESTAURANT_ID, 'Monday') == _data(200.0)
+
+
+def test_menu_cache_invalidates_on_new_last_scraping():
+    menu_cache: MenuCache = MenuCache()
+    menu_cache.set(RESTAURANT_ID, 'Monday', _data(100.0), {'Monday': 1, 'last_scraping': 10.0})
+
+    # Scraping did not change any day, but cached data contain the time of the last scraping
+    menu_cache.on_menu_update(json.dumps({'restaurant_id': RESTAURANT_ID, 'days': {}, 'last_scraping': 20.0}))
+
+    assert menu_cache.get(RESTAURANT_ID, 'Monday') is None
+
+
+def test_menu_cache_loads_misses_in_bulk(client, monkeypatch):
+    restaurant = RESTAURANTS[0]
+    meal: RestaurantMeal = RestaurantMeal('Guláš', 100.0, None, ['1'])
+    save_days(client, restaurant.restaurant_id(), RestaurantMeal.serialize_meals({'Monday': [meal], 'Tuesday': []}))
+
+    def ping():
+        raise AssertionError('Connection is checked by the bulk fetch.')
+
+    monkeypatch.setattr(client, 'ping', ping)
+    menu_cache: MenuCache = MenuCache()
+    data: list = menu_cache.get_restaurants_data('Monday', None)
+
+    assert len(data) == len(RESTAURANTS)
+    assert data[0]['meals'] == {'Monday': [meal.to_dict()]}
+    assert menu_cache.get(restaurant.restaurant_id(), 'Monday') == data[0]
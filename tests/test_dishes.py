@@ -0,0 +1,67 @@
+import fakeredis
+import pytest
+
+from restaurants.dishes import DishIndex, fold_text, words_match
+from restaurants.models import RestaurantMeal
+
+
+def _meal(name: str, description: str = 'Brambory, okurkový salát', price: float = 149.0) -> RestaurantMeal:
+    return RestaurantMeal(name, price, description, ['1', '3'])
+
+
+@pytest.mark.parametrize('text, other_text, expected', [
+    ('kureci prirodni rizek', 'kureci prirodni rizek', True),
+    ('kureci prirodni rizek s bramborem', 'kureci prirodni rizek s brambory', True),
+    ('smazeny syr hranolky', 'smazeny syr hranolek', True),
+    ('veprovy prirodni rizek', 'kureci prirodni rizek', False),
+    ('hovezi vyvar s nudlemi', 'hovezi vyvar se zeleninou', False),
+    ('gulas 150g', 'gulas 200g', False),
+    ('gulas', 'gulas s knedlikem', False),
+])
+def test_words_match(text, other_text, expected):
+    assert words_match(text, other_text) is expected
+
+
+def test_normalize_meals_variants_share_dish():
+    client = fakeredis.FakeRedis()
+    dish_index: DishIndex = DishIndex()
+
+    meals: dict = {
+        'Monday': [_meal('* Kuřecí  přírodní řízek')],
+        'Tuesday': [_meal('KUŘECÍ PŘÍRODNÍ ŘÍZEK,')],
+        'Wednesday': [_meal('Kuřecí přírodní řízky')],
+    }
+    assert dish_index.normalize_meals(client, meals) == 1
+
+    dish_ids: set = {meal.dish_id for day_meals in meals.values() for meal in day_meals}
+    assert len(dish_ids) == 1
+
+    # Variants keep their own (cleaned) text
+    assert [day_meals[0].name for day_meals in meals.values()] == [
+        'Kuřecí přírodní řízek', 'KUŘECÍ PŘÍRODNÍ ŘÍZEK', 'Kuřecí přírodní řízky',
+    ]
+
+
+def test_normalize_meals_keeps_distinct_dishes():
+    client = fakeredis.FakeRedis()
+    dish_index: DishIndex = DishIndex()
+
+    # Near duplicates (similar n-grams) which are different dishes
+    meals: dict = {
+        'Monday': [_meal('Kuřecí přírodní řízek'), _meal('Hovězí vývar s nudlemi', None, 45.0)],
+        'Tuesday': [_meal('Vepřový přírodní řízek'), _meal('Hovězí vývar s játrovými knedlíčky', None, 45.0)],
+    }
+    assert dish_index.normalize_meals(client, meals) == 4
+
+    assert len({meal.dish_id for day_meals in meals.values() for meal in day_meals}) == 4
+    assert meals['Tuesday'][0].name == 'Vepřový přírodní řízek'
+
+    # Text of the variant survives the round trip through references
+    raw_days: dict = RestaurantMeal.serialize_meals(meals)
+    loaded: dict = RestaurantMeal.deserialize_meals(raw_days, lambda dish_ids: dish_index.get_many(client, dish_ids))
+    assert [meal.name for meal in loaded['Tuesday']] == ['Vepřový přírodní řízek', 'Hovězí vývar s játrovými knedlíčky']
+    assert loaded['Tuesday'][0].alergens == ['1', '3']
+
+
+def test_fold_text():
+    assert fold_text(' Vepřový   ŘÍZEK, brambory! ') == 'veprovy rizek brambory'
@@ -0,0 +1,38 @@
+import fakeredis
+import pytest
+
+from locks import LeaseLock
+
+
+@pytest.fixture
+def client() -> fakeredis.FakeRedis:
+    return fakeredis.FakeRedis()
+
+
+def test_lease_lock_single_owner(client):
+    lock: LeaseLock = LeaseLock(client, 'scraping', 60, owner='first')
+    other: LeaseLock = LeaseLock(client, 'scraping', 60, owner='second')
+
+    assert lock.acquire() == 1
+    assert other.acquire() is None
+    assert other.holder == 'first'
+
+    # Holder renews the lease with the same token, others can not release it
+    assert lock.acquire() == 1
+    assert other.release() is False
+    assert lock.release() is True
+    assert lock.holder is None
+
+
+def test_lease_lock_fencing_tokens_increase(client):
+    lock: LeaseLock = LeaseLock(client, 'scraping', 60, owner='first')
+    lock.acquire()
+    lock.release()
+
+    assert LeaseLock(client, 'scraping', 60, owner='second').acquire() == 2
+
+
+def test_lease_lock_acquire_wait_timeout(client):
+    LeaseLock(client, 'scraping', 60).acquire()
+
+    assert LeaseLock(client, 'scraping', 60).acquire_wait(0.1, interval=0.01) is None
@@ -0,0 +1,38 @@
+import fakeredis
+import pytest
+
+from storage import StaleFencingTokenError, load_days, load_versions, save_days
+
+
+RESTAURANT_ID: int = 1
+
+
+@pytest.fixture
+def client() -> fakeredis.FakeRedis:
+    return fakeredis.FakeRedis()
+
+
+def test_save_days_rewrites_only_changed_days(client):
+    assert save_days(client, RESTAURANT_ID, {'Monday': '[1]', 'Tuesday': '[2]'}) == {'Monday': 1, 'Tuesday': 1}
+    assert save_days(client, RESTAURANT_ID, {'Monday': '[1]', 'Tuesday': '[3]'}) == {'Tuesday': 2}
+
+    assert load_days(client, RESTAURANT_ID) == {'Monday': '[1]', 'Tuesday': '[3]'}
+    assert load_versions(client, RESTAURANT_ID) == {'Monday': 1, 'Tuesday': 2}
+
+
+def test_save_days_unchanged(client):
+    save_days(client, RESTAURANT_ID, {'Monday': '[1]'})
+
+    assert save_days(client, RESTAURANT_ID, {'Monday': '[1]'}) == {}
+    assert load_versions(client, RESTAURANT_ID) == {'Monday': 1}
+
+
+def test_save_days_rejects_stale_fencing_token(client):
+    save_days(client, RESTAURANT_ID, {'Monday': '[1]'}, fencing_token=2)
+
+    # Holder of the expired lock (older token) must not overwrite meals of the newer one
+    with pytest.raises(StaleFencingTokenError):
+        save_days(client, RESTAURANT_ID, {'Monday': '[old]'}, fencing_token=1)
+
+    assert load_days(client, RESTAURANT_ID) == {'Monday': '[1]'}
+    assert save_days(client, RESTAURANT_ID, {'Monday': '[2]'}, fencing_token=3) == {'Monday': 2}
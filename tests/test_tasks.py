@@ -0,0 +1,66 @@
+import fakeredis
+import pytest
+
+import tasks
+
+
+class PendingResult:
+    """Result of a task unknown to the backend (Celery reports it as pending)."""
+
+    state: str = 'PENDING'
+
+    def __init__(self, *args, **kwargs) -> None:
+        pass
+
+
+@pytest.fixture
+def client(monkeypatch) -> fakeredis.FakeRedis:
+    client: fakeredis.FakeRedis = fakeredis.FakeRedis()
+    monkeypatch.setattr(tasks, 'get_redis_client', lambda: client)
+    monkeypatch.setattr(tasks, 'AsyncResult', PendingResult)
+    monkeypatch.setattr(tasks.scrape, 'apply_async', lambda **kwargs: None)
+    return client
+
+
+def test_enqueue_scraping_coalesces_running_job(client):
+    job_id: str = tasks.enqueue_scraping()
+
+    assert tasks.enqueue_scraping() == job_id
+    assert tasks.get_scraping_job(job_id)['status'] == 'PENDING'
+
+
+def test_enqueue_scraping_releases_lock_when_not_sent(client, monkeypatch):
+    def fail(**kwargs):
+        raise ConnectionError('Broker is down.')
+
+    monkeypatch.setattr(tasks.scrape, 'apply_async', fail)
+    with pytest.raises(ConnectionError):
+        tasks.enqueue_scraping()
+
+    assert tasks._scraping_run_lock().holder is None
+
+
+def test_get_scraping_job_unknown(client):
+    assert tasks.get_scraping_job('unknown') is None
+
+
+def test_scrape_skipped_when_other_run_is_in_progress(client):
+    running_job_id: str = tasks.enqueue_scraping()
+
+    assert tasks.scrape.apply(task_id='periodic').result is None
+    assert tasks.get_scraping_job('periodic') == {
+        'job_id': 'periodic', 'status': 'SKIPPED', 'failed_scrapers': None, 'coalesced_with': running_job_id,
+    }
+
+
+def test_finish_scraping_records_stats_and_ends_run(client):
+    job_id: str = tasks.enqueue_scraping()
+    results: list = [
+        {'restaurant': 'Thalie', 'status': 'success', 'duration': 2.0},
+        {'restaurant': 'Namaskar', 'status': 'failed', 'duration': 5.0},
+    ]
+
+    assert tasks.finish_scraping(results, run_id=job_id, started_at=0.0) == 1
+    assert tasks.get_scraping_job(job_id)['status'] == 'SUCCESS'
+    assert tasks.get_scraping_job(job_id)['failed_scrapers'] == 1
+    assert tasks._scraping_run_lock().holder is None
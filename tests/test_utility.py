@@ -0,0 +1,129 @@
+from datetime import date
+
+import pytest
+from flask import Response
+from flask_restful import fields, marshal
+
+from restaurants import RESTAURANTS_RESPONSE, RestaurantMeal
+from utility import MappingField, MarshalWith, RangeField, resolve_day, week_date
+
+
+# Week from Monday 2024-03-04 to Sunday 2024-03-10
+MONDAY: date = date(2024, 3, 4)
+FRIDAY: date = date(2024, 3, 8)
+SATURDAY: date = date(2024, 3, 9)
+SUNDAY: date = date(2024, 3, 10)
+
+
+@pytest.mark.parametrize('value, today, expected', [
+    ('today', MONDAY, 'Monday'),
+    ('tomorrow', MONDAY, 'Tuesday'),
+    ('Wednesday', MONDAY, 'Wednesday'),
+    ('friday', MONDAY, 'Friday'),
+    ('2024-03-07', MONDAY, 'Thursday'),
+    ('all', MONDAY, None),
+    ('', MONDAY, None),
+    (None, MONDAY, None),
+])
+def test_resolve_day(value, today, expected):
+    assert resolve_day(value, today) == expected
+
+
+@pytest.mark.parametrize('value, today, expected', [
+    ('today', SATURDAY, 'Saturday'),
+    ('today', SUNDAY, 'Sunday'),
+    ('tomorrow', FRIDAY, 'Saturday'),
+    ('tomorrow', SATURDAY, 'Sunday'),
+    ('2024-03-09', MONDAY, 'Saturday'),
+    ('2024-03-10', SATURDAY, 'Sunday'),
+    ('Saturday', MONDAY, 'Saturday'),
+    ('sunday', MONDAY, 'Sunday'),
+])
+def test_resolve_day_weekend(value, today, expected):
+    # Weekend days are resolved consistently (relative, literal and ISO dates), they are served with empty meals
+    assert resolve_day(value, today) == expected
+
+
+@pytest.mark.parametrize('value, today', [
+    ('someday', MONDAY),
+    ('2024-03-11', SUNDAY),  # Next week
+    ('2024-03-03', MONDAY),  # Previous week
+])
+def test_resolve_day_invalid(value, today):
+    with pytest.raises(ValueError):
+        resolve_day(value, today)
+
+
+@pytest.mark.parametrize('day, reference, expected', [
+    ('Monday', MONDAY, date(2024, 3, 4)),
+    ('Friday', date(2024, 3, 6), date(2024, 3, 8)),
+    ('Monday', SATURDAY, date(2024, 3, 11)),  # Menus of the next week are published over the weekend
+    ('Friday', SUNDAY, date(2024, 3, 15)),
+])
+def test_week_date(day, reference, expected):
+    assert week_date(day, reference) == expected
+
+
+@pytest.mark.parametrize('field, value, expected', [
+    (RangeField(minimum=-90, maximum=90), '49.19', 49.19),
+    (RangeField(minimum=-90, maximum=90), '-90', -90.0),
+    (RangeField(int, minimum=1), '500', 500),
+])
+def test_range_field(field, value, expected):
+    assert field.parse(value) == expected
+
+
+@pytest.mark.parametrize('field, value', [
+    (RangeField(minimum=-90, maximum=90), '200'),
+    (RangeField(minimum=-90, maximum=90), 'nan'),
+    (RangeField(minimum=-90, maximum=90), 'north'),
+    (RangeField(int, minimum=1), '0'),
+    (RangeField(int, minimum=1), '-5'),
+    (RangeField(int, minimum=1), '1.5'),
+])
+def test_range_field_invalid(field, value):
+    with pytest.raises(fields.MarshallingException):
+        field.parse(value)
+
+
+def _restaurant(index: int) -> dict:
+    return {
+        'name': f'Restaurace {index}', 'url': 'https://example.com', 'accepts_cards': index % 2,
+        'last_scrape': '2024-03-04 10:15:42', 'address': 'Náměstí Míru 1, Brno (602 00)',
+        'meals': {
+            'Monday': [
+                {'name': 'Gulášová polévka', 'price': 45, 'description': None, 'alergens': ['1', '9'],
+                 'is_vegan': False, 'is_gluten_free': False, 'is_soup': True, 'dish_id': 'a1b2'},
+                {'name': 'Svíčková', 'price': '189.5', 'alergens': None, 'is_vegan': 0},
+            ],
+            'Tuesday': [],
+        },
+    }
+
+
+@pytest.mark.parametrize('payload', [
+    {'loaded_scrapers': 12, 'data_size': 2, 'data': [_restaurant(0), dict(_restaurant(1), distance=120)]},
+    {'loaded_scrapers': 12, 'data_size': 0, 'data': []},
+    {'loaded_scrapers': None, 'data': None},
+])
+def test_marshal_with_matches_flask_restful(payload):
+    assert RESTAURANTS_RESPONSE.marshal(payload) == marshal(payload, RESTAURANTS_RESPONSE.schema)
+
+
+def test_marshal_with_attribute_and_nested_schema():
+    schema: dict = {
+        'id': fields.String(attribute='restaurant_id'),
+        'location': {'lat': fields.Float, 'lon': fields.Float(default=0.0)},
+        'meals': MappingField(fields.List(fields.Nested(RestaurantMeal.MEAL_FIELDS))),
+    }
+    payload: dict = {'restaurant_id': 7, 'lat': '49.19', 'meals': {'Friday': [{'name': 'Řízek', 'price': 150}]}}
+
+    assert MarshalWith(schema).marshal(payload) == marshal(payload, schema)
+
+
+def test_marshal_with_passes_responses_through():
+    response: Response = Response(b'{}', mimetype='application/json')
+    decorated = MarshalWith({'name': fields.String})
+
+    assert decorated(lambda: response)() is response
+    assert decorated(lambda: ({'name': 'Thalie', 'url': 'x'}, 201))() == ({'name': 'Thalie'}, 201)